@@ -1,12 +1,30 @@
 import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
-from search import get_vectorstore, create_rag_chain
+from search import (
+	get_vectorstore,
+	get_semantic_cache,
+	retrieve_documents,
+	build_context,
+	create_rag_chain,
+	RAG_TOP_K
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
+# Threads para embeddings, busca e gravação no cache, fora do event loop do chat
+CHAT_WORKERS = int(os.getenv("CHAT_WORKERS", "4"))
+
+
+@lru_cache(maxsize=4)
 def get_llm(provider: str = "openai"):
-	"""Retorna instância do LLM configurado.
+	"""Retorna instância do LLM configurado (criada uma vez por provider).
 
 	Args:
 		provider: Provedor de IA a ser usado. Opções: "openai" ou "google" (padrão: "openai")
@@ -19,7 +37,7 @@ def get_llm(provider: str = "openai"):
 	if provider == "openai":
 		if not os.getenv("OPENAI_API_KEY"):
 			raise ValueError("OPENAI_API_KEY não encontrada no .env!")
-		print("🔑 Usando OpenAI LLM")
+		logger.info("🔑 Usando OpenAI LLM")
 		from langchain_openai import ChatOpenAI
 		return ChatOpenAI(
 			model="gpt-5-nano",
@@ -29,7 +47,7 @@ def get_llm(provider: str = "openai"):
 	elif provider == "google":
 		if not os.getenv("GOOGLE_API_KEY"):
 			raise ValueError("GOOGLE_API_KEY não encontrada no .env!")
-		print("🔑 Usando Google Gemini LLM")
+		logger.info("🔑 Usando Google Gemini LLM")
 		from langchain_google_genai import ChatGoogleGenerativeAI
 		return ChatGoogleGenerativeAI(
 			model="gemini-2.5-flash-lite",
@@ -40,8 +58,72 @@ def get_llm(provider: str = "openai"):
 		raise ValueError(f"Provider '{provider}' não suportado! Use 'openai' ou 'google'.")
 
 
-def main():
-	"""Função principal do chat CLI."""
+def ainput(prompt: str = ""):
+	"""Lê uma linha do terminal sem bloquear o event loop.
+
+	Returns:
+		Future com a linha digitada
+	"""
+	loop = asyncio.get_running_loop()
+	future = loop.create_future()
+
+	def resolve(setter, value):
+		if not future.done():
+			setter(value)
+
+	def read():
+		try:
+			line = input(prompt)
+		except BaseException as e:
+			loop.call_soon_threadsafe(resolve, future.set_exception, e)
+		else:
+			loop.call_soon_threadsafe(resolve, future.set_result, line)
+
+	threading.Thread(target=read, daemon=True).start()
+	return future
+
+
+async def with_spinner(awaitable, interval: float = 0.1):
+	"""Aguarda `awaitable` imprimindo um ponto a cada `interval` segundos."""
+	task = asyncio.ensure_future(awaitable)
+	try:
+		while True:
+			done, _ = await asyncio.wait({task}, timeout=interval)
+			if done:
+				break
+			print(".", end="", flush=True)
+	finally:
+		if not task.done():
+			task.cancel()
+		print()
+	return task.result()
+
+
+async def retrieve_context(cache, vectorstore, query):
+	"""Busca o contexto da pergunta, consultando o cache semântico antes do vectorstore.
+
+	Returns:
+		Tupla (entrada, embedding), em que `entrada` contém "context" e, se a
+		pergunta já foi respondida antes, "answer"
+	"""
+	cached, q_emb = await asyncio.to_thread(cache.lookup, query)
+	if cached is not None:
+		return cached, q_emb
+
+	results = await asyncio.to_thread(retrieve_documents, vectorstore, q_emb, k=RAG_TOP_K)
+	return {"context": build_context(results)}, q_emb
+
+
+async def save_to_cache(cache, query, q_emb, context, answer):
+	"""Grava a resposta no cache semântico sem bloquear a próxima pergunta."""
+	try:
+		await asyncio.to_thread(cache.put, query, q_emb, {"context": context, "answer": answer})
+	except Exception as e:
+		print(f"⚠️  Não foi possível salvar no cache: {e}")
+
+
+async def amain():
+	"""Função principal do chat CLI (assíncrona)."""
 	print("🤖 Chat de Busca Semântica")
 	print("=" * 50)
 	print("Digite 'sair' para encerrar\n")
@@ -51,19 +133,27 @@ def main():
 		llm = get_llm()
 		print("✅ LLM inicializado com sucesso!\n")
 
-		# Criar chain RAG
+		# Criar chain RAG (vectorstore e cache são instâncias compartilhadas)
 		chain = create_rag_chain(llm)
 		vectorstore = get_vectorstore()
+		cache = get_semantic_cache()
 		print("✅ Vectorstore conectado com sucesso!\n")
 
 	except Exception as e:
 		print(f"❌ Erro ao inicializar: {e}")
 		return
 
+	asyncio.get_running_loop().set_default_executor(
+		ThreadPoolExecutor(max_workers=CHAT_WORKERS, thread_name_prefix="chat")
+	)
+
+	# Gravações no cache em andamento (mantidas referenciadas até terminarem)
+	pending = set()
+
 	while True:
 		try:
 			# Receber pergunta do usuário
-			query = input("Faça sua pergunta: ").strip()
+			query = (await ainput("Faça sua pergunta: ")).strip()
 
 			# Verificar se quer sair
 			if query.lower() in ['sair', 'exit', 'quit']:
@@ -75,36 +165,62 @@ def main():
 				print("⚠️  Por favor, digite uma pergunta válida.\n")
 				continue
 
-			# Buscar contexto
-			print("\n🔍 Buscando informações...")
+			# Buscar contexto (cache semântico antes do vectorstore)
+			print("\n🔍 Buscando informações", end="", flush=True)
 			try:
-				results = vectorstore.similarity_search_with_score(query, k=10)
-				context = "\n\n".join([doc.page_content for doc, _ in results])
+				found, q_emb = await with_spinner(retrieve_context(cache, vectorstore, query))
 			except Exception as e:
 				print(f"❌ Erro ao buscar informações: {e}\n")
 				continue
 
-			# Executar chain RAG
+			if found.get("answer"):
+				print("PERGUNTA:", query)
+				print("RESPOSTA:", found["answer"])
+				print("\n" + "-" * 50 + "\n")
+				continue
+
+			context = found["context"]
+
+			# Executar chain RAG, exibindo a resposta à medida que é gerada
 			print("💭 Gerando resposta...\n")
+			print("PERGUNTA:", query)
+			print("RESPOSTA: ", end="", flush=True)
 			try:
-				response = chain.invoke({"context": context, "query": query})
-				response_text = response["text"]
+				tokens = []
+				async for token in chain.astream({"context": context, "query": query}):
+					print(token, end="", flush=True)
+					tokens.append(token)
+				response_text = "".join(tokens)
+				print()
 			except Exception as e:
-				print(f"❌ Erro ao gerar resposta: {e}\n")
+				print(f"\n❌ Erro ao gerar resposta: {e}\n")
 				continue
 
-			# Exibir resposta formatada
-			print("PERGUNTA:", query)
-			print("RESPOSTA:", response_text)
+			# Guardar no cache semântico enquanto o usuário digita a próxima pergunta
+			task = asyncio.create_task(save_to_cache(cache, query, q_emb, context, response_text))
+			pending.add(task)
+			task.add_done_callback(pending.discard)
+
 			print("\n" + "-" * 50 + "\n")
 
-		except KeyboardInterrupt:
+		except (KeyboardInterrupt, asyncio.CancelledError):
 			print("\n\n👋 Encerrando chat...")
 			break
 		except Exception as e:
 			print(f"\n❌ Erro: {e}\n")
 			continue
 
+	if pending:
+		await asyncio.gather(*pending)
+
+
+def main():
+	"""Função principal do chat CLI."""
+	try:
+		asyncio.run(amain())
+	except KeyboardInterrupt:
+		print("\n\n👋 Encerrando chat...")
+
 
 if __name__ == "__main__":
 	main()
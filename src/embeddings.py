@@ -0,0 +1,149 @@
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+# Dimensões dos embeddings OpenAI text-embedding-3-* (Matryoshka; 0 mantém o vetor inteiro)
+EMBED_DIM = int(os.getenv("EMBED_DIM", "512"))
+
+# Coleção das respostas persistidas pelo cache semântico (ver search.get_semantic_cache)
+SEMANTIC_CACHE_COLLECTION = os.getenv("SEMANTIC_CACHE_COLLECTION", "semantic_cache")
+
+
+class NormalizedEmbeddings(Embeddings):
+	"""Embeddings normalizados pela norma L2, para busca por produto interno."""
+
+	def __init__(self, inner: Embeddings):
+		"""Inicializa o wrapper.
+
+		Args:
+			inner: Instância de embeddings do provedor
+		"""
+		self.inner = inner
+
+	@staticmethod
+	def _normalize(vectors):
+		vectors = np.asarray(vectors, dtype=np.float32)
+		norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+		norms[norms == 0] = 1.0
+		return (vectors / norms).tolist()
+
+	def embed_documents(self, texts):
+		"""Vetoriza os textos e retorna os embeddings normalizados."""
+		if not texts:
+			return []
+		return self._normalize(self.inner.embed_documents(texts))
+
+	def embed_query(self, text):
+		"""Vetoriza a pergunta e retorna o embedding normalizado."""
+		return self._normalize(self.inner.embed_query(text))
+
+
+class WarmedUpEmbeddings(Embeddings):
+	"""Embeddings carregados e aquecidos em segundo plano."""
+
+	def __init__(self, factory, warmup_text: str = "warmup"):
+		"""Inicia o carregamento do modelo.
+
+		Args:
+			factory: Função sem argumentos que cria a instância de embeddings
+			warmup_text: Texto usado na inferência de aquecimento
+		"""
+		self.inner = None
+		self._factory = factory
+		self._warmup_text = warmup_text
+		self._lock = threading.Lock()
+		self._start()
+
+	def _start(self):
+		self._error = None
+		self._ready = threading.Event()
+		threading.Thread(target=self._load, args=(self._ready,), daemon=True).start()
+
+	def _load(self, ready):
+		try:
+			inner = self._factory()
+			inner.embed_query(self._warmup_text)
+			self.inner = inner
+		except Exception as e:
+			self._error = e
+		finally:
+			ready.set()
+
+	def wait(self, timeout: float = None) -> bool:
+		"""Aguarda o fim do carregamento; retorna False se o timeout expirar."""
+		return self._ready.wait(timeout)
+
+	def _get_inner(self):
+		while True:
+			ready = self._ready
+			ready.wait()
+			with self._lock:
+				if self._ready is not ready:
+					# Outra chamada já reiniciou o carregamento: aguardar o novo
+					continue
+				if self._error is None:
+					return self.inner
+				error = self._error
+				self._start()
+			raise error
+
+	def embed_documents(self, texts):
+		"""Vetoriza os textos após o aquecimento do modelo."""
+		return self._get_inner().embed_documents(texts)
+
+	def embed_query(self, text):
+		"""Vetoriza a pergunta após o aquecimento do modelo."""
+		return self._get_inner().embed_query(text)
+
+
+def resolve_provider(provider: str):
+	"""Retorna o provedor de embeddings: EMBEDDING_BACKEND, se definida e não vazia, ou `provider`."""
+	return (os.getenv("EMBEDDING_BACKEND") or provider).lower()
+
+
+def get_openai_dimensions(model: str, dimensions: int):
+	"""Retorna `dimensions` para modelos `text-embedding-3-*` (Matryoshka), senão None."""
+	if dimensions > 0 and model.startswith("text-embedding-3-"):
+		return dimensions
+	return None
+
+
+def create_embeddings(provider: str = "openai", background: bool = False):
+	"""Cria a instância de embeddings do provedor, a mesma na ingestão e na busca.
+
+	Args:
+		provider: Provedor de IA a ser usado. Opções: "openai", "google" ou "local" (padrão: "openai").
+			A variável EMBEDDING_BACKEND, se definida, tem precedência.
+		background: Carrega o modelo local em segundo plano (ver `WarmedUpEmbeddings`)
+
+	Returns:
+		Instância de embeddings configurada
+	"""
+	provider = resolve_provider(provider)
+
+	if provider == "openai":
+		if not os.getenv("OPENAI_API_KEY"):
+			raise ValueError("OPENAI_API_KEY não encontrada no .env!")
+		from langchain_openai import OpenAIEmbeddings
+		model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+		return OpenAIEmbeddings(model=model, dimensions=get_openai_dimensions(model, EMBED_DIM))
+	elif provider == "google":
+		if not os.getenv("GOOGLE_API_KEY"):
+			raise ValueError("GOOGLE_API_KEY não encontrada no .env!")
+		from langchain_google_genai import GoogleGenerativeAIEmbeddings
+		return GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+	elif provider == "local":
+		from langchain_community.embeddings import FastEmbedEmbeddings
+		model = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+
+		def factory():
+			return FastEmbedEmbeddings(model_name=model, threads=os.cpu_count())
+
+		return WarmedUpEmbeddings(factory) if background else factory()
+	else:
+		raise ValueError(f"Provider '{provider}' não suportado! Use 'openai', 'google' ou 'local'.")
@@ -1,21 +1,76 @@
 import os
+import re
+import hashlib
+import pickle
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 from langchain_postgres import PGVector
+from sqlalchemy import text
+from tqdm import tqdm
+from embeddings import NormalizedEmbeddings, SEMANTIC_CACHE_COLLECTION, create_embeddings, resolve_provider
 
 load_dotenv()
 
 PDF_PATH = os.getenv("PDF_PATH", "document.pdf")
 
+# Cache em disco das páginas extraídas do PDF (habilitado com PDF_CACHE=1)
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", ".cache")
+
+# Separadores de chunk, em ordem de preferência: parágrafo, linha, frase, vírgula, palavra
+SEPARATORS = ("\n\n", "\n", ". ", ", ", " ")
+_WHITESPACE_RE = re.compile(r"\s")
+PAGE_SEPARATOR = "\n\n"
+
+# Tipo da coluna de embeddings: "halfvec" (FP16, metade do espaço) ou "vector" (FP32)
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "halfvec").lower()
+
+# Limite de textos por requisição de embeddings de cada provedor
+EMBED_BATCH_LIMITS = {"openai": 256, "google": 100, "local": 256}
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "8"))
+
+# Parâmetros HNSW (m, ef_construction) por faixa de quantidade de vetores;
+# o ef_search da busca é definido em search.py (HNSW_EF_SEARCH)
+HNSW_PARAMS = [
+		(100_000, (16, 64)),
+		(1_000_000, (24, 100)),
+		(None, (32, 128)),
+]
+
+# Memória e workers da construção do índice. Em build paralelo, a memória é alocada
+# em shared memory: o container precisa de `shm_size` maior que HNSW_MAINTENANCE_WORK_MEM
+HNSW_MAINTENANCE_WORK_MEM = os.getenv("HNSW_MAINTENANCE_WORK_MEM", "1GB")
+HNSW_MAINTENANCE_WORKERS = int(os.getenv("HNSW_MAINTENANCE_WORKERS", "7"))
+
+
+def get_pdf_cache_path(file_path: str):
+		"""Retorna o arquivo de cache do PDF, identificado pelo hash do conteúdo."""
+		key = hashlib.sha256(Path(file_path).read_bytes()).hexdigest()[:16]
+		return Path(PDF_CACHE_DIR) / f"pdf_{key}.pkl"
+
 
 def load_pdf(file_path: str):
-		"""Carrega arquivo PDF e extrai texto."""
+		"""Carrega arquivo PDF e extrai texto (com cache em disco se PDF_CACHE=1)."""
 		print(f"📄 Carregando PDF: {file_path}...")
 		try:
+				cache_path = get_pdf_cache_path(file_path) if os.getenv("PDF_CACHE") == "1" else None
+				if cache_path and cache_path.exists():
+						with open(cache_path, "rb") as f:
+								documents = pickle.load(f)
+						print(f"✅ PDF carregado do cache! {len(documents)} páginas encontradas.")
+						return documents
+
 				loader = PyPDFLoader(file_path)
 				documents = loader.load()
 				print(f"✅ PDF carregado! {len(documents)} páginas encontradas.")
+
+				if cache_path:
+						cache_path.parent.mkdir(parents=True, exist_ok=True)
+						with open(cache_path, "wb") as f:
+								pickle.dump(documents, f)
 				return documents
 		except FileNotFoundError:
 				print(f"❌ Erro: Arquivo {file_path} não encontrado!")
@@ -25,14 +80,62 @@ def load_pdf(file_path: str):
 				raise
 
 
+def fast_split(content: str, size: int = 1000, overlap: int = 150):
+		"""Divide o texto em spans de até `size` caracteres com `overlap` entre chunks.
+
+		Args:
+				content: Texto a ser dividido
+				size: Tamanho máximo de cada chunk
+				overlap: Sobreposição aproximada entre chunks consecutivos
+
+		Returns:
+				Lista de tuplas (início, fim) com as posições de cada chunk em `content`
+		"""
+		spans = []
+		start = 0
+		length = len(content)
+		while start < length:
+				limit = start + size
+				if limit >= length:
+						spans.append((start, length))
+						break
+
+				# Último separador (por prioridade) que termine entre start + overlap e o limite
+				end = limit
+				for separator in SEPARATORS:
+						position = content.rfind(separator, start + overlap, limit)
+						if position != -1:
+								end = position + len(separator)
+								break
+				spans.append((start, end))
+
+				# Próximo chunk começa após o primeiro espaço dentro da janela de overlap
+				match = _WHITESPACE_RE.search(content, end - overlap, end)
+				start = match.end() if match else end - overlap
+
+		return spans
+
+
 def split_documents(documents):
 		"""Divide documentos em chunks de 1000 caracteres com overlap de 150."""
 		print("✂️  Dividindo documentos em chunks...")
-		text_splitter = RecursiveCharacterTextSplitter(
-				chunk_size=1000,
-				chunk_overlap=150
-		)
-		chunks = text_splitter.split_documents(documents)
+		offsets = []
+		position = 0
+		for doc in documents:
+				offsets.append(position)
+				position += len(doc.page_content) + len(PAGE_SEPARATOR)
+		content = PAGE_SEPARATOR.join(doc.page_content for doc in documents)
+
+		chunks = []
+		for start, end in fast_split(content, size=1000, overlap=150):
+				raw = content[start:end]
+				page_content = raw.strip()
+				if not page_content:
+						continue
+				# Página do primeiro caractere não-branco do chunk
+				page = documents[bisect_right(offsets, start + len(raw) - len(raw.lstrip())) - 1]
+				chunks.append(Document(page_content=page_content, metadata=dict(page.metadata)))
+
 		print(f"✅ {len(chunks)} chunks criados!")
 		return chunks
 
@@ -41,38 +144,216 @@ def get_embeddings(provider: str = "openai"):
 		"""Retorna instância de embeddings configurada.
 
 		Args:
-				provider: Provedor de IA a ser usado. Opções: "openai" ou "google" (padrão: "openai")
+				provider: Provedor de IA a ser usado. Opções: "openai", "google" ou "local" (padrão: "openai").
+						A variável EMBEDDING_BACKEND, se definida, tem precedência.
 
 		Returns:
 				Instância de embeddings configurada
 		"""
-		provider = provider.lower()
-
-		if provider == "openai":
-				if not os.getenv("OPENAI_API_KEY"):
-						raise ValueError("OPENAI_API_KEY não encontrada no .env!")
-				print("🔑 Usando OpenAI Embeddings")
-				from langchain_openai import OpenAIEmbeddings
-				model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
-				return OpenAIEmbeddings(model=model)
-		elif provider == "google":
-				if not os.getenv("GOOGLE_API_KEY"):
-						raise ValueError("GOOGLE_API_KEY não encontrada no .env!")
-				print("🔑 Usando Google Gemini Embeddings")
-				from langchain_google_genai import GoogleGenerativeAIEmbeddings
-				return GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-		else:
-				raise ValueError(f"Provider '{provider}' não suportado! Use 'openai' ou 'google'.")
-
-
-def store_documents(chunks, embeddings, connection_string, collection_name=None):
-		"""Armazena chunks e embeddings no PostgreSQL."""
+		embeddings = create_embeddings(provider)
+		print(f"🔑 Usando {type(embeddings).__name__}")
+		return embeddings
+
+
+def configure_hnsw_params(vector_count: int):
+		"""Escolhe os parâmetros do índice HNSW de acordo com o volume de vetores.
+
+		Args:
+				vector_count: Quantidade de vetores na tabela de embeddings
+
+		Returns:
+				Tupla (m, ef_construction)
+		"""
+		for limit, params in HNSW_PARAMS:
+				if limit is None or vector_count < limit:
+						return params
+
+
+def get_storage_dtype(dtype: str = None):
+		"""Retorna o tipo da coluna de embeddings validado ("halfvec" ou "vector")."""
+		dtype = (dtype or EMBEDDING_STORAGE_DTYPE).lower()
+		if dtype not in ("halfvec", "vector"):
+				raise ValueError(f"EMBEDDING_STORAGE_DTYPE '{dtype}' não suportado! Use 'halfvec' ou 'vector'.")
+		return dtype
+
+
+def create_hnsw_index(vectorstore, dtype: str = None):
+		"""Cria índice HNSW (produto interno) na coluna de embeddings.
+
+		Args:
+				vectorstore: Vectorstore PGVector com os documentos já armazenados
+				dtype: Tipo da coluna, "halfvec" ou "vector" (padrão: EMBEDDING_STORAGE_DTYPE)
+		"""
+		dtype = get_storage_dtype(dtype)
+		table = vectorstore.EmbeddingStore.__tablename__
+		index = f"idx_{table}_hnsw"
+		opclass = f"{dtype}_ip_ops"
+		print("🗂️  Criando índice HNSW...")
+		with vectorstore.session_maker() as session:
+				vector_count = session.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+				if not vector_count:
+						print("⚠️  Nenhum vetor armazenado, índice não criado.")
+						return
+
+				m, ef_construction = configure_hnsw_params(vector_count)
+				session.execute(text(f"SET LOCAL maintenance_work_mem = '{HNSW_MAINTENANCE_WORK_MEM}'"))
+				session.execute(text(f"SET LOCAL max_parallel_maintenance_workers = {HNSW_MAINTENANCE_WORKERS}"))
+				index_definition = session.execute(text(
+						f"SELECT indexdef FROM pg_indexes WHERE indexname = '{index}'"
+				)).scalar()
+				if index_definition and f"(embedding {opclass})" not in index_definition:
+						session.execute(text(f"DROP INDEX IF EXISTS {index}"))
+				session.execute(text(
+						f"CREATE INDEX IF NOT EXISTS {index} ON {table} "
+						f"USING hnsw (embedding {opclass}) "
+						f"WITH (m = {m}, ef_construction = {ef_construction})"
+				))
+				session.commit()
+		print(f"✅ Índice HNSW criado ({opclass}, m={m}, ef_construction={ef_construction})!")
+
+
+def delete_sources(session, vectorstore, sources):
+		"""Remove da coleção os chunks gravados a partir dos arquivos informados, sem commit.
+
+		Args:
+				session: Sessão do banco em que a remoção é executada
+				vectorstore: Vectorstore PGVector conectado ao banco
+				sources: Arquivos de origem (`metadata["source"]`) dos chunks a remover
+		"""
+		if not sources:
+				return
+		table = vectorstore.EmbeddingStore.__tablename__
+		collection_table = vectorstore.CollectionStore.__tablename__
+		session.execute(
+				text(
+						f"DELETE FROM {table} WHERE collection_id = "
+						f"(SELECT uuid FROM {collection_table} WHERE name = :name) "
+						"AND cmetadata->>'source' = ANY(:sources)"
+				),
+				{"name": vectorstore.collection_name, "sources": sorted(sources)}
+		)
+
+
+def clear_semantic_cache(session, vectorstore):
+		"""Remove as respostas persistidas pelo cache semântico, mantendo a coleção, sem commit.
+
+		Args:
+				session: Sessão do banco em que a remoção é executada
+				vectorstore: Vectorstore PGVector conectado ao banco
+		"""
+		table = vectorstore.EmbeddingStore.__tablename__
+		collection_table = vectorstore.CollectionStore.__tablename__
+		session.execute(
+				text(
+						f"DELETE FROM {table} WHERE collection_id = "
+						f"(SELECT uuid FROM {collection_table} WHERE name = :name)"
+				),
+				{"name": SEMANTIC_CACHE_COLLECTION}
+		)
+
+
+def prepare_ingestion(vectorstore, dimensions: int, sources=(), dtype: str = None):
+		"""Remove os chunks substituídos e o cache e converte a coluna de embeddings, em uma transação.
+
+		Args:
+				vectorstore: Vectorstore PGVector conectado ao banco
+				dimensions: Dimensão dos embeddings que serão armazenados
+				sources: Arquivos de origem dos chunks que serão substituídos
+				dtype: Tipo da coluna, "halfvec" ou "vector" (padrão: EMBEDDING_STORAGE_DTYPE)
+
+		Raises:
+				ValueError: Se houver vetores mantidos na tabela com outra dimensão (nada é alterado)
+		"""
+		dtype = get_storage_dtype(dtype)
+		table = vectorstore.EmbeddingStore.__tablename__
+		collection_table = vectorstore.CollectionStore.__tablename__
+		column_type = f"{dtype}({dimensions})"
+		with vectorstore.session_maker() as session:
+				current_type = session.execute(text(
+						"SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+						f"WHERE attrelid = '{table}'::regclass AND attname = 'embedding'"
+				)).scalar()
+				convert = current_type != column_type
+
+				if convert:
+						# Vetores que continuarão na tabela: exceto o cache e os chunks substituídos
+						mismatched = session.execute(
+								text(
+										f"SELECT count(*) FROM {table} e JOIN {collection_table} c ON c.uuid = e.collection_id "
+										"WHERE vector_dims(e.embedding) <> :dimensions AND c.name <> :cache "
+										"AND (c.name = :name AND e.cmetadata->>'source' = ANY(:sources)) IS NOT TRUE"
+								),
+								{
+										"dimensions": dimensions,
+										"cache": SEMANTIC_CACHE_COLLECTION,
+										"name": vectorstore.collection_name,
+										"sources": sorted(sources)
+								}
+						).scalar()
+						if mismatched:
+								raise ValueError(
+										f"A tabela {table} tem {mismatched} vetores com dimensão diferente de {dimensions} "
+										f"(coluna {current_type}). Remova as coleções geradas com outro modelo de "
+										"embeddings ou use o mesmo modelo da ingestão anterior."
+								)
+
+				delete_sources(session, vectorstore, sources)
+				clear_semantic_cache(session, vectorstore)
+
+				if convert:
+						# O opclass do índice depende do tipo da coluna: recriar após a conversão
+						session.execute(text(f"DROP INDEX IF EXISTS idx_{table}_hnsw"))
+						session.execute(text(
+								f"ALTER TABLE {table} ALTER COLUMN embedding TYPE {column_type} "
+								f"USING embedding::{column_type}"
+						))
+				session.commit()
+		if convert:
+				print(f"🔧 Coluna de embeddings convertida para {column_type}")
+
+
+def get_batch_size(provider: str = "openai"):
+		"""Retorna o tamanho do lote de embeddings (EMBED_BATCH_SIZE), limitado pelo provedor.
+
+		Args:
+				provider: Provedor de IA a ser usado. Opções: "openai" ou "google" (padrão: "openai")
+
+		Returns:
+				Quantidade de chunks por requisição de embeddings
+		"""
+		provider = resolve_provider(provider)
+		limit = EMBED_BATCH_LIMITS.get(provider, EMBED_BATCH_LIMITS["openai"])
+		return min(int(os.getenv("EMBED_BATCH_SIZE", limit)), limit)
+
+
+def get_max_workers(provider: str = "openai"):
+		"""Retorna a quantidade de lotes de embeddings processados em paralelo (1 para o modelo local).
+
+		Args:
+				provider: Provedor de IA a ser usado. Opções: "openai", "google" ou "local" (padrão: "openai")
+
+		Returns:
+				Quantidade de threads de embeddings
+		"""
+		provider = resolve_provider(provider)
+		if provider == "local":
+				return 1
+		return EMBED_MAX_WORKERS
+
+
+def store_documents(chunks, embeddings, connection_string, collection_name=None, batch_size=None,
+				max_workers=None):
+		"""Armazena chunks e embeddings no PostgreSQL, substituindo os chunks dos mesmos arquivos."""
 		print("💾 Armazenando no banco de dados...")
 		try:
+				max_workers = max_workers or EMBED_MAX_WORKERS
+
+				# Uma conexão do pool por thread de embeddings
 				vectorstore_params = {
-						"embeddings": embeddings,
+						"embeddings": NormalizedEmbeddings(embeddings),
 						"connection": connection_string,
-						"use_jsonb": True
+						"use_jsonb": True,
+						"engine_args": {"pool_size": max_workers}
 				}
 
 				# Adicionar collection_name se fornecido
@@ -81,9 +362,27 @@ def store_documents(chunks, embeddings, connection_string, collection_name=None)
 
 				vectorstore = PGVector(**vectorstore_params)
 
-				# Adicionar documentos
-				vectorstore.add_documents(chunks)
+				# Dimensão dos embeddings que serão gravados, obtida antes de alterar o banco;
+				# substitui os chunks dos mesmos arquivos, invalida o cache e tipa a coluna
+				if chunks:
+						dimensions = len(vectorstore.embeddings.embed_query(chunks[0].page_content))
+						sources = {chunk.metadata.get("source") for chunk in chunks} - {None}
+						prepare_ingestion(vectorstore, dimensions, sources)
+
+				# Adicionar documentos em lotes paralelos
+				batch_size = batch_size or get_batch_size()
+				batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+				with ThreadPoolExecutor(max_workers=max_workers) as executor:
+						list(tqdm(
+								executor.map(vectorstore.add_documents, batches),
+								total=len(batches),
+								desc="Embeddings",
+								unit="lote"
+						))
 				print(f"✅ {len(chunks)} documentos armazenados com sucesso!")
+
+				# Indexar para busca aproximada (HNSW)
+				create_hnsw_index(vectorstore)
 				return vectorstore
 		except Exception as e:
 				print(f"❌ Erro ao armazenar: {e}")
@@ -115,7 +414,14 @@ def ingest_pdf(provider: str = "openai"):
 				collection_name = os.getenv("PG_VECTOR_COLLECTION_NAME") or os.getenv("PGVECTOR_COLLECTION")
 
 				# 6. Armazenar no banco
-				vectorstore = store_documents(chunks, embeddings, connection_string, collection_name)
+				vectorstore = store_documents(
+						chunks,
+						embeddings,
+						connection_string,
+						collection_name,
+						batch_size=get_batch_size(provider),
+						max_workers=get_max_workers(provider)
+				)
 
 				print("\n🎉 Ingestão concluída com sucesso!")
 				return vectorstore
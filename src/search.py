@@ -1,11 +1,30 @@
 import os
+import atexit
+from functools import lru_cache
+import numpy as np
 from dotenv import load_dotenv
-from langchain_postgres import PGVector
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from sqlalchemy import create_engine, select
+from semantic_cache import SemanticCache
+from embeddings import NormalizedEmbeddings, SEMANTIC_CACHE_COLLECTION, create_embeddings
 
 load_dotenv()
 
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "100"))
+
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "8"))
+
+# Quantidade de chunks enviados como contexto ao LLM
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+
+# Re-ranqueamento MMR (diversidade) entre RAG_FETCH_K candidatos, habilitado com RAG_MMR=1
+RAG_MMR = os.getenv("RAG_MMR") == "1"
+RAG_FETCH_K = int(os.getenv("RAG_FETCH_K", "20"))
+
+CONTEXT_SEPARATOR = "\n\n"
+
 PROMPT_TEMPLATE = """
 CONTEXTO:
 {context}
@@ -33,40 +52,32 @@ PERGUNTA DO USUÁRIO:
 RESPONDA A "PERGUNTA DO USUÁRIO"
 """
 
+# Partes fixas do template, separadas uma única vez para montar o prompt por concatenação
+_PROMPT_PREFIX, _rest = PROMPT_TEMPLATE.split("{context}", 1)
+_PROMPT_MIDDLE, _PROMPT_SUFFIX = _rest.split("{query}", 1)
+del _rest
+
 
+@lru_cache(maxsize=4)
 def get_embeddings(provider: str = "openai"):
-		"""Retorna instância de embeddings configurada (mesma da ingestão).
+		"""Retorna instância de embeddings configurada (mesma da ingestão), uma por provider.
 
 		Args:
-				provider: Provedor de IA a ser usado. Opções: "openai" ou "google" (padrão: "openai")
+				provider: Provedor de IA a ser usado. Opções: "openai", "google" ou "local" (padrão: "openai").
+						A variável EMBEDDING_BACKEND, se definida, tem precedência.
 
 		Returns:
 				Instância de embeddings configurada
 		"""
-		provider = provider.lower()
-
-		if provider == "openai":
-				if not os.getenv("OPENAI_API_KEY"):
-						raise ValueError("OPENAI_API_KEY não encontrada no .env!")
-				from langchain_openai import OpenAIEmbeddings
-				return OpenAIEmbeddings()
-		elif provider == "google":
-				if not os.getenv("GOOGLE_API_KEY"):
-						raise ValueError("GOOGLE_API_KEY não encontrada no .env!")
-				from langchain_google_genai import GoogleGenerativeAIEmbeddings
-				return GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-		else:
-				raise ValueError(f"Provider '{provider}' não suportado! Use 'openai' ou 'google'.")
-
+		return create_embeddings(provider, background=True)
 
-def get_vectorstore(provider: str = "openai"):
-	"""Retorna instância do vectorstore conectado ao banco.
 
-	Args:
-		provider: Provedor de IA a ser usado. Opções: "openai" ou "google" (padrão: "openai")
+@lru_cache(maxsize=1)
+def get_engine():
+	"""Retorna o engine compartilhado, com pool de conexões e `hnsw.ef_search` definido.
 
 	Returns:
-		Instância do vectorstore conectado
+		Instância de sqlalchemy.engine.Engine
 	"""
 	# Suporta DATABASE_URL ou POSTGRES_CONNECTION_STRING
 	connection_string = os.getenv("DATABASE_URL") or os.getenv("POSTGRES_CONNECTION_STRING")
@@ -74,28 +85,165 @@ def get_vectorstore(provider: str = "openai"):
 	if not connection_string:
 		raise ValueError("DATABASE_URL ou POSTGRES_CONNECTION_STRING não encontrada no .env!")
 
-	# Configurar embeddings (mesmo da ingestão)
-	embeddings = get_embeddings(provider)
+	engine = create_engine(
+		connection_string,
+		pool_size=PG_POOL_MAX,
+		connect_args={"options": f"-c hnsw.ef_search={HNSW_EF_SEARCH}"}
+	)
+	atexit.register(engine.dispose)
+	return engine
+
+
+@lru_cache(maxsize=4)
+def get_vectorstore(provider: str = "openai"):
+	"""Retorna instância do vectorstore conectado ao banco, uma por provider.
+
+	Args:
+		provider: Provedor de IA a ser usado. Opções: "openai" ou "google" (padrão: "openai")
+
+	Returns:
+		Instância do vectorstore conectado
+	"""
+	# Pool de conexões compartilhado
+	engine = get_engine()
+
+	# Configurar embeddings (mesmo da ingestão, normalizados)
+	embeddings = NormalizedEmbeddings(get_embeddings(provider))
 
 	# Obter nome da coleção (opcional)
 	collection_name = os.getenv("PG_VECTOR_COLLECTION_NAME") or os.getenv("PGVECTOR_COLLECTION")
 
 	# Conectar ao vectorstore existente
+	from langchain_postgres.vectorstores import DistanceStrategy
 	vectorstore_params = {
 		"embeddings": embeddings,
-		"connection": connection_string,
-		"use_jsonb": True
+		"connection": engine,
+		"use_jsonb": True,
+		"distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT
 	}
 
 	# Adicionar collection_name se fornecido
 	if collection_name:
 		vectorstore_params["collection_name"] = collection_name
 
+	from langchain_postgres import PGVector
 	vectorstore = PGVector(**vectorstore_params)
 
 	return vectorstore
 
 
+@lru_cache(maxsize=4)
+def get_semantic_cache(provider: str = "openai"):
+	"""Retorna o cache semântico compartilhado, persistido na coleção `semantic_cache`.
+
+	Args:
+		provider: Provedor de IA a ser usado. Opções: "openai" ou "google" (padrão: "openai")
+
+	Returns:
+		Instância de SemanticCache (a mesma para chamadas com o mesmo provider)
+	"""
+	engine = get_engine()
+	embeddings = get_embeddings(provider)
+	from langchain_postgres import PGVector
+	from langchain_postgres.vectorstores import DistanceStrategy
+	store = PGVector(
+		embeddings=embeddings,
+		connection=engine,
+		collection_name=SEMANTIC_CACHE_COLLECTION,
+		use_jsonb=True,
+		distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+	)
+
+	return SemanticCache(embeddings, store=store)
+
+
+def search_documents(vectorstore, embedding, k: int = RAG_TOP_K):
+	"""Busca os k chunks mais próximos do embedding, sem carregar a coluna `embedding`.
+
+	Args:
+		vectorstore: Instância de PGVector
+		embedding: Embedding da pergunta
+		k: Quantidade de chunks retornados (padrão: RAG_TOP_K)
+
+	Returns:
+		Lista de tuplas (Document, distância)
+	"""
+	EmbeddingStore = vectorstore.EmbeddingStore
+	CollectionStore = vectorstore.CollectionStore
+	distance = vectorstore.distance_strategy(list(map(float, embedding))).label("distance")
+	collection_id = (
+		select(CollectionStore.uuid)
+		.where(CollectionStore.name == vectorstore.collection_name)
+		.scalar_subquery()
+	)
+	statement = (
+		select(EmbeddingStore.document, EmbeddingStore.cmetadata, distance)
+		.where(EmbeddingStore.collection_id == collection_id)
+		.order_by(distance)
+		.limit(k)
+	)
+
+	with vectorstore.session_maker() as session:
+		rows = session.execute(statement).all()
+
+	return [
+		(Document(page_content=row.document, metadata=row.cmetadata), row.distance)
+		for row in rows
+	]
+
+
+def retrieve_documents(vectorstore, embedding, k: int = RAG_TOP_K):
+	"""Retorna os k chunks do contexto, re-ranqueados por MMR se RAG_MMR=1.
+
+	Args:
+		vectorstore: Instância de PGVector
+		embedding: Embedding da pergunta
+		k: Quantidade de chunks retornados (padrão: RAG_TOP_K)
+
+	Returns:
+		Lista de Document, do mais para o menos relevante
+	"""
+	if RAG_MMR:
+		return vectorstore.max_marginal_relevance_search_by_vector(
+			list(map(float, embedding)),
+			k=k,
+			fetch_k=max(RAG_FETCH_K, k)
+		)
+
+	return [doc for doc, _ in search_documents(vectorstore, embedding, k=k)]
+
+
+def build_context(documents):
+	"""Concatena o conteúdo dos chunks, separados por linha em branco."""
+	return CONTEXT_SEPARATOR.join([doc.page_content for doc in documents])
+
+
+def rerank(query_embedding, doc_embeddings, topk: int = 10):
+	"""Ordena candidatos por similaridade cosseno com a pergunta.
+
+	Args:
+		query_embedding: Embedding da pergunta, shape (D,)
+		doc_embeddings: Embeddings dos candidatos, shape (k, D)
+		topk: Quantidade de índices retornados (padrão: 10)
+
+	Returns:
+		Índices dos `topk` candidatos mais similares, do mais para o menos similar
+	"""
+	q = np.asarray(query_embedding, dtype=np.float32)
+	D = np.asarray(doc_embeddings, dtype=np.float32)
+	if D.shape[0] == 0:
+		return np.empty(0, dtype=np.intp)
+
+	q = q / (np.linalg.norm(q) or 1.0)
+	norms = np.linalg.norm(D, axis=1, keepdims=True)
+	norms[norms == 0] = 1.0
+	scores = (D / norms) @ q
+
+	topk = min(topk, len(scores))
+	idx = np.argpartition(-scores, topk - 1)[:topk]
+	return idx[np.argsort(-scores[idx])]
+
+
 def search_prompt(question: str, provider: str = "openai"):
 	"""Busca chunks relevantes e monta prompt com contexto.
 
@@ -107,29 +255,30 @@ def search_prompt(question: str, provider: str = "openai"):
 		return None
 
 	try:
-		# 1. Obter vectorstore
-		vectorstore = get_vectorstore(provider)
+		# 1. Consultar cache semântico (match exato ou pergunta similar)
+		cache = get_semantic_cache(provider)
+		cached, q_emb = cache.lookup(question)
 
-		# 2. Buscar k=10 chunks mais relevantes
-		results = vectorstore.similarity_search_with_score(
-			query=question,
-			k=10
-		)
+		if cached is not None:
+			context = cached["context"]
+		else:
+			# 2. Obter vectorstore
+			vectorstore = get_vectorstore(provider)
 
-		# 3. Montar contexto com os chunks
-		context_parts = []
-		for doc, score in results:
-			context_parts.append(doc.page_content)
+			# 3. Buscar os RAG_TOP_K chunks mais relevantes (reaproveitando o embedding do cache)
+			results = retrieve_documents(vectorstore, q_emb, k=RAG_TOP_K)
 
-		context = "\n\n".join(context_parts)
+			# 4. Montar contexto com os chunks
+			context = build_context(results)
 
-		# 4. Montar prompt completo
-		prompt = PROMPT_TEMPLATE.format(
-			context=context,
-			query=question
-		)
+			# Falha ao gravar no cache não invalida a busca
+			try:
+				cache.put(question, q_emb, {"context": context})
+			except Exception as e:
+				print(f"⚠️  Não foi possível salvar no cache: {e}")
 
-		return prompt
+		# 5. Montar prompt completo
+		return "".join((_PROMPT_PREFIX, context, _PROMPT_MIDDLE, question, _PROMPT_SUFFIX))
 
 	except Exception as e:
 		print(f"❌ Erro na busca: {e}")
@@ -137,10 +286,11 @@ def search_prompt(question: str, provider: str = "openai"):
 
 
 def create_rag_chain(llm):
-    """Cria chain RAG completa."""
+    """Cria chain RAG completa (prompt | llm | texto), com suporte a `stream`."""
     prompt_template = PromptTemplate(
 			template=PROMPT_TEMPLATE,
-			input_variables=["context", "query"]
+			input_variables=["context", "query"],
+			validate_template=False
     )
 
-    return LLMChain(llm=llm, prompt=prompt_template)
+    return prompt_template | llm | StrOutputParser()
@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL_DAYS = 7
+
+
+def _normalize(vector):
+	"""Converte o vetor para float32 e normaliza pela norma L2."""
+	vector = np.asarray(vector, dtype=np.float32)
+	norm = np.linalg.norm(vector)
+	if norm > 0:
+		vector = vector / norm
+	return vector
+
+
+class SemanticCache:
+	"""Cache de respostas em dois níveis: match exato e similaridade semântica."""
+
+	def __init__(self, embeddings, threshold: float = None, max_entries: int = None,
+			ttl_days: float = None, store=None):
+		"""Inicializa o cache.
+
+		Args:
+			embeddings: Instância de embeddings usada para vetorizar as perguntas
+			threshold: Similaridade mínima para um hit semântico (padrão: SEMANTIC_CACHE_THRESHOLD ou 0.95)
+			max_entries: Número máximo de entradas em memória (padrão: SEMANTIC_CACHE_MAX_ENTRIES ou 2048)
+			ttl_days: Validade das entradas em dias (padrão: SEMANTIC_CACHE_TTL_DAYS ou 7)
+			store: Vectorstore opcional para persistir as entradas (PGVector com
+				distância MAX_INNER_PRODUCT, já que os embeddings são normalizados)
+		"""
+		if threshold is None:
+			threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD))
+		if max_entries is None:
+			max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+		if ttl_days is None:
+			ttl_days = float(os.getenv("SEMANTIC_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS))
+
+		self.embeddings = embeddings
+		self.threshold = threshold
+		self.max_entries = max_entries
+		self.ttl = ttl_days * 86400
+		self.store = store
+
+		# Nível exato: chave -> slot na matriz de embeddings (ordem LRU)
+		self.exact = OrderedDict()
+		# Nível semântico: matriz (N, D) alocada no primeiro put e lista paralela de (timestamp, valor)
+		self.emb = None
+		self.answers = [None] * max_entries
+		self._keys = [None] * max_entries
+		self._size = 0
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def key(query: str) -> str:
+		"""Retorna a chave do nível exato para a pergunta."""
+		return hashlib.sha256(query.encode()).hexdigest()
+
+	def embed(self, query: str):
+		"""Vetoriza a pergunta e retorna o embedding normalizado (float32)."""
+		return _normalize(self.embeddings.embed_query(query))
+
+	def _is_fresh(self, timestamp: float) -> bool:
+		return time.time() - timestamp < self.ttl
+
+	def lookup(self, query: str, embedding=None):
+		"""Busca uma resposta em cache para a pergunta.
+
+		Args:
+			query: Pergunta do usuário
+			embedding: Embedding já calculado da pergunta (opcional)
+
+		Returns:
+			Tupla (valor, embedding). `valor` é None em caso de miss; `embedding` é o
+			vetor normalizado da pergunta (o já armazenado, em hits do nível exato),
+			para ser reaproveitado na busca vetorial e no `put`, sem nova chamada ao modelo.
+		"""
+		key = self.key(query)
+		with self._lock:
+			slot = self.exact.get(key)
+			if slot is not None:
+				timestamp, value = self.answers[slot]
+				if self._is_fresh(timestamp):
+					self.exact.move_to_end(key)
+					return value, self.emb[slot].copy()
+
+		if embedding is None:
+			embedding = self.embed(query)
+		else:
+			embedding = _normalize(embedding)
+
+		with self._lock:
+			if self._size:
+				sims = self.emb[:self._size] @ embedding
+				best = int(np.argmax(sims))
+				if sims[best] >= self.threshold:
+					timestamp, value = self.answers[best]
+					if self._is_fresh(timestamp):
+						self.exact.move_to_end(self._keys[best])
+						return value, embedding
+
+		if self.store is not None:
+			try:
+				value = self._lookup_store(query, embedding)
+			except Exception as e:
+				# Falha na coleção persistida conta como miss: o cache não interrompe a busca
+				logger.warning("Falha ao consultar o cache semântico persistido: %s", e)
+				value = None
+			if value is not None:
+				return value, embedding
+
+		return None, embedding
+
+	def get(self, query: str, embedding=None):
+		"""Retorna o valor em cache para a pergunta ou None."""
+		value, _ = self.lookup(query, embedding)
+		return value
+
+	def put(self, query: str, embedding, value, persist: bool = True):
+		"""Armazena um valor para a pergunta.
+
+		Args:
+			query: Pergunta do usuário
+			embedding: Embedding da pergunta (calculado se None)
+			value: Valor a ser armazenado (serializável em JSON se houver persistência)
+			persist: Se True, grava também no vectorstore de persistência
+		"""
+		if embedding is None:
+			embedding = self.embed(query)
+		embedding = _normalize(embedding)
+		timestamp = time.time()
+		key = self.key(query)
+		self._insert(key, embedding, timestamp, value)
+
+		if persist and self.store is not None:
+			self.store.add_embeddings(
+				texts=[query],
+				embeddings=[embedding.tolist()],
+				metadatas=[{"timestamp": timestamp, "value": value}],
+				ids=[key]
+			)
+
+	def _insert(self, key: str, embedding, timestamp: float, value):
+		"""Grava a entrada em memória, reaproveitando o slot LRU quando cheio."""
+		with self._lock:
+			if self.emb is None:
+				self.emb = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+
+			slot = self.exact.pop(key, None)
+			if slot is None:
+				if self._size < self.max_entries:
+					slot = self._size
+					self._size += 1
+				else:
+					# Reaproveita o slot da entrada menos usada recentemente
+					_, slot = self.exact.popitem(last=False)
+
+			self.emb[slot] = embedding
+			self.answers[slot] = (timestamp, value)
+			self._keys[slot] = key
+			self.exact[key] = slot
+
+	def _lookup_store(self, query: str, embedding):
+		"""Consulta a coleção persistida e promove o hit para a memória."""
+		results = self.store.similarity_search_with_score_by_vector(embedding.tolist(), k=1)
+		if not results:
+			return None
+
+		# `<#>` retorna o produto interno negativo, que em vetores unitários é -cos_sim
+		doc, distance = results[0]
+		timestamp = doc.metadata.get("timestamp", 0)
+		if -distance < self.threshold or not self._is_fresh(timestamp):
+			return None
+
+		value = doc.metadata.get("value")
+		self._insert(self.key(query), embedding, timestamp, value)
+		return value
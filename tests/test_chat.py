@@ -1,16 +1,22 @@
 import unittest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import ANY, Mock, patch, MagicMock
+import asyncio
+import io
 import os
 import sys
+from contextlib import redirect_stdout
 
 # Adicionar src ao path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from chat import get_llm
+from chat import get_llm, ainput, amain, with_spinner
 
 class TestGetLLM(unittest.TestCase):
 	"""Testes para obtenção do LLM."""
 
+	def setUp(self):
+		get_llm.cache_clear()
+
 	@patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'})
 	@patch('langchain_openai.ChatOpenAI')
 	def test_get_llm_openai(self, mock_chat_class):
@@ -21,6 +27,7 @@ class TestGetLLM(unittest.TestCase):
 		result = get_llm()
 
 		self.assertEqual(result, mock_llm)
+		self.assertIs(get_llm(), result)
 		mock_chat_class.assert_called_once_with(
 			model="gpt-5-nano",
 			temperature=0.0,
@@ -50,9 +57,115 @@ class TestGetLLM(unittest.TestCase):
 			get_llm()
 
 
-# Nota: Testes de integração do main() são mais complexos devido ao input()
-# e podem ser feitos manualmente ou com ferramentas como pytest-cov
-# Para testes automatizados do loop de chat, seria necessário mockar input()
+class TestAinput(unittest.TestCase):
+	"""Testes para leitura assíncrona do terminal."""
+
+	@patch('builtins.input', return_value="Pergunta")
+	def test_ainput(self, mock_input):
+		"""Testa leitura da linha digitada."""
+		async def read():
+			return await ainput("> ")
+
+		self.assertEqual(asyncio.run(read()), "Pergunta")
+		mock_input.assert_called_once_with("> ")
+
+	@patch('builtins.input', side_effect=EOFError)
+	def test_ainput_eof(self, mock_input):
+		"""Testa propagação de erros do input()."""
+		async def read():
+			return await ainput("> ")
+
+		with self.assertRaises(EOFError):
+			asyncio.run(read())
+
+
+class TestWithSpinner(unittest.TestCase):
+	"""Testes para o indicador de progresso."""
+
+	def test_with_spinner(self):
+		"""Testa retorno do resultado e impressão de pontos enquanto aguarda."""
+		async def slow():
+			await asyncio.sleep(0.05)
+			return "resultado"
+
+		output = io.StringIO()
+		with redirect_stdout(output):
+			result = asyncio.run(with_spinner(slow(), interval=0.01))
+
+		self.assertEqual(result, "resultado")
+		self.assertIn(".", output.getvalue())
+		self.assertTrue(output.getvalue().endswith("\n"))
+
+	def test_with_spinner_error(self):
+		"""Testa propagação de erros da operação aguardada."""
+		async def failing():
+			raise RuntimeError("Erro de conexão")
+
+		with redirect_stdout(io.StringIO()), self.assertRaises(RuntimeError):
+			asyncio.run(with_spinner(failing()))
+
+
+class TestAmain(unittest.TestCase):
+	"""Testes para o loop assíncrono do chat."""
+
+	def setUp(self):
+		self.mock_cache = Mock()
+		self.mock_chain = Mock()
+
+		async def astream(inputs):
+			for token in ["Faturamento ", "de 10 milhões."]:
+				yield token
+
+		self.mock_chain.astream = Mock(side_effect=astream)
+		for target, value in (
+			('chat.get_llm', Mock()),
+			('chat.create_rag_chain', self.mock_chain),
+			('chat.get_vectorstore', Mock()),
+			('chat.get_semantic_cache', self.mock_cache),
+		):
+			patcher = patch(target, return_value=value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def run_chat(self, *answers):
+		async def fake_input(prompt=""):
+			return answers_iter.pop(0)
+
+		answers_iter = list(answers)
+		output = io.StringIO()
+		with patch('chat.ainput', side_effect=fake_input), redirect_stdout(output):
+			asyncio.run(amain())
+		return output.getvalue()
+
+	@patch('chat.retrieve_documents')
+	def test_amain_turn(self, mock_retrieve_documents):
+		"""Testa uma pergunta completa: busca, streaming e gravação no cache."""
+		self.mock_cache.lookup.return_value = (None, [0.1, 0.2])
+		mock_doc = Mock()
+		mock_doc.page_content = "Contexto"
+		mock_retrieve_documents.return_value = [mock_doc]
+
+		output = self.run_chat("Qual o faturamento?", "sair")
+
+		self.assertIn("Faturamento de 10 milhões.", output)
+		mock_retrieve_documents.assert_called_once_with(ANY, [0.1, 0.2], k=5)
+		self.mock_chain.astream.assert_called_once_with({"context": "Contexto", "query": "Qual o faturamento?"})
+		self.mock_cache.put.assert_called_once_with(
+			"Qual o faturamento?",
+			[0.1, 0.2],
+			{"context": "Contexto", "answer": "Faturamento de 10 milhões."}
+		)
+
+	@patch('chat.retrieve_documents')
+	def test_amain_cache_hit(self, mock_retrieve_documents):
+		"""Testa que uma resposta em cache é exibida sem chamar a busca nem o LLM."""
+		self.mock_cache.lookup.return_value = ({"context": "Contexto", "answer": "Resposta em cache"}, None)
+
+		output = self.run_chat("Qual o faturamento?", "sair")
+
+		self.assertIn("Resposta em cache", output)
+		mock_retrieve_documents.assert_not_called()
+		self.mock_chain.astream.assert_not_called()
 
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+import threading
+from unittest.mock import Mock, patch
+import os
+import sys
+
+# Adicionar src ao path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from embeddings import (
+	NormalizedEmbeddings,
+	WarmedUpEmbeddings,
+	get_openai_dimensions,
+	resolve_provider,
+	create_embeddings
+)
+
+
+class TestNormalizedEmbeddings(unittest.TestCase):
+	"""Testes para o wrapper de embeddings normalizados."""
+
+	def setUp(self):
+		self.inner = Mock()
+		self.embeddings = NormalizedEmbeddings(self.inner)
+
+	def test_embed_query(self):
+		"""Testa normalização do embedding da pergunta."""
+		self.inner.embed_query.return_value = [3.0, 4.0]
+
+		result = self.embeddings.embed_query("Pergunta")
+
+		self.assertAlmostEqual(result[0], 0.6, places=5)
+		self.assertAlmostEqual(result[1], 0.8, places=5)
+		self.inner.embed_query.assert_called_once_with("Pergunta")
+
+	def test_embed_documents(self):
+		"""Testa normalização por linha, preservando vetores nulos."""
+		self.inner.embed_documents.return_value = [[0.0, 2.0], [0.0, 0.0]]
+
+		result = self.embeddings.embed_documents(["A", "B"])
+
+		self.assertEqual(result, [[0.0, 1.0], [0.0, 0.0]])
+
+	def test_embed_documents_empty(self):
+		"""Testa que uma lista vazia não chama o provedor."""
+		self.assertEqual(self.embeddings.embed_documents([]), [])
+		self.inner.embed_documents.assert_not_called()
+
+
+
+class TestWarmedUpEmbeddings(unittest.TestCase):
+	"""Testes para o carregamento do modelo em segundo plano."""
+
+	def test_waits_for_warmup(self):
+		"""Testa que as chamadas aguardam o carregamento e o aquecimento."""
+		release = threading.Event()
+		inner = Mock()
+		inner.embed_query.return_value = [0.1, 0.2]
+
+		def factory():
+			release.wait()
+			return inner
+
+		embeddings = WarmedUpEmbeddings(factory)
+		self.assertFalse(embeddings.wait(timeout=0.01))
+
+		release.set()
+		self.assertEqual(embeddings.embed_query("Pergunta"), [0.1, 0.2])
+		self.assertEqual(
+			[c.args[0] for c in inner.embed_query.call_args_list],
+			["warmup", "Pergunta"]
+		)
+
+	def test_load_error(self):
+		"""Testa que um erro no carregamento é propagado nas chamadas."""
+		def factory():
+			raise RuntimeError("Modelo não encontrado")
+
+		embeddings = WarmedUpEmbeddings(factory)
+
+		with self.assertRaises(RuntimeError):
+			embeddings.embed_documents(["A"])
+
+	def test_retries_after_load_error(self):
+		"""Testa que o carregamento é refeito na chamada seguinte a uma falha."""
+		inner = Mock()
+		inner.embed_query.return_value = [0.1, 0.2]
+		factory = Mock(side_effect=[RuntimeError("Falha no download"), inner])
+
+		embeddings = WarmedUpEmbeddings(factory)
+
+		with self.assertRaises(RuntimeError):
+			embeddings.embed_query("Pergunta")
+		self.assertEqual(embeddings.embed_query("Pergunta"), [0.1, 0.2])
+		self.assertEqual(factory.call_count, 2)
+
+
+
+class TestGetOpenaiDimensions(unittest.TestCase):
+	"""Testes para o parâmetro `dimensions` dos embeddings OpenAI."""
+
+	def test_matryoshka_model(self):
+		"""Testa que modelos text-embedding-3-* recebem a dimensão configurada."""
+		self.assertEqual(get_openai_dimensions("text-embedding-3-small", 512), 512)
+		self.assertEqual(get_openai_dimensions("text-embedding-3-large", 1024), 1024)
+
+	def test_other_models_keep_full_vector(self):
+		"""Testa que modelos sem Matryoshka ou EMBED_DIM=0 mantêm o vetor inteiro."""
+		self.assertIsNone(get_openai_dimensions("text-embedding-ada-002", 512))
+		self.assertIsNone(get_openai_dimensions("text-embedding-3-small", 0))
+
+
+class TestResolveProvider(unittest.TestCase):
+	"""Testes para a escolha do provedor de embeddings."""
+
+	@patch.dict(os.environ, {'EMBEDDING_BACKEND': 'LOCAL'})
+	def test_backend_overrides_provider(self):
+		"""Testa que EMBEDDING_BACKEND tem precedência sobre o provedor informado."""
+		self.assertEqual(resolve_provider("openai"), "local")
+
+	@patch.dict(os.environ, {'EMBEDDING_BACKEND': ''})
+	def test_empty_backend_uses_provider(self):
+		"""Testa que EMBEDDING_BACKEND vazia (como no .env.example) é ignorada."""
+		self.assertEqual(resolve_provider("google"), "google")
+
+
+
+class TestCreateEmbeddings(unittest.TestCase):
+	"""Testes para a criação dos embeddings compartilhada por ingestão e busca."""
+
+	@patch.dict(os.environ, {}, clear=True)
+	@patch('langchain_community.embeddings.FastEmbedEmbeddings')
+	def test_local_loaded_in_foreground(self, mock_embeddings_class):
+		"""Testa que, sem `background`, o modelo local é criado na chamada."""
+		self.assertIs(create_embeddings("local"), mock_embeddings_class.return_value)
+
+	@patch.dict(os.environ, {}, clear=True)
+	def test_unsupported_provider(self):
+		"""Testa erro com provedor não suportado."""
+		with self.assertRaises(ValueError):
+			create_embeddings("azure")
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -2,17 +2,27 @@ import unittest
 from unittest.mock import Mock, patch, MagicMock
 import os
 import sys
+import tempfile
+
+from langchain_core.documents import Document
 
 # Adicionar src ao path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from ingest import (
 	load_pdf,
+	fast_split,
 	split_documents,
 	get_embeddings,
+	configure_hnsw_params,
+	get_batch_size,
+	get_max_workers,
+	prepare_ingestion,
+	create_hnsw_index,
 	store_documents,
 	ingest_pdf
 )
+from embeddings import NormalizedEmbeddings
 
 
 class TestLoadPdf(unittest.TestCase):
@@ -47,47 +57,102 @@ class TestLoadPdf(unittest.TestCase):
 		with self.assertRaises(FileNotFoundError):
 			load_pdf("nonexistent.pdf")
 
+	@patch('ingest.PyPDFLoader')
+	def test_load_pdf_cache(self, mock_loader_class):
+		"""Testa reaproveitamento das páginas em cache com PDF_CACHE=1."""
+		mock_loader = Mock()
+		mock_loader.load.return_value = [Document(page_content="Conteúdo da página 1")]
+		mock_loader_class.return_value = mock_loader
+
+		with tempfile.TemporaryDirectory() as tmp:
+			pdf_path = os.path.join(tmp, "test.pdf")
+			with open(pdf_path, "wb") as f:
+				f.write(b"%PDF-1.4 teste")
+
+			with patch.dict(os.environ, {'PDF_CACHE': '1'}), patch('ingest.PDF_CACHE_DIR', tmp):
+				first = load_pdf(pdf_path)
+				second = load_pdf(pdf_path)
+
+			# Verificar
+			self.assertEqual(first, second)
+			mock_loader.load.assert_called_once()
+			self.assertEqual(len([name for name in os.listdir(tmp) if name.endswith(".pkl")]), 1)
+
 
 class TestSplitDocuments(unittest.TestCase):
 	"""Testes para divisão de documentos em chunks."""
 
-	@patch('ingest.RecursiveCharacterTextSplitter')
-	def test_split_documents(self, mock_splitter_class):
+	def test_split_documents(self):
 		"""Testa divisão de documentos em chunks."""
-		# Mock dos documentos
-		mock_doc1 = Mock()
-		mock_doc1.page_content = "A" * 2000  # Texto grande
-		mock_doc2 = Mock()
-		mock_doc2.page_content = "B" * 500
-		documents = [mock_doc1, mock_doc2]
-
-		# Mock do splitter
-		mock_splitter = Mock()
-		mock_chunk1 = Mock()
-		mock_chunk1.page_content = "A" * 1000
-		mock_chunk2 = Mock()
-		mock_chunk2.page_content = "A" * 1000
-		mock_chunk3 = Mock()
-		mock_chunk3.page_content = "B" * 500
-		mock_splitter.split_documents.return_value = [mock_chunk1, mock_chunk2, mock_chunk3]
-		mock_splitter_class.return_value = mock_splitter
+		# Documentos (páginas)
+		doc1 = Document(page_content="A" * 2000, metadata={"page": 0})
+		doc2 = Document(page_content="B" * 500, metadata={"page": 1})
+		documents = [doc1, doc2]
 
 		# Executar
 		result = split_documents(documents)
 
 		# Verificar
 		self.assertEqual(len(result), 3)
-		mock_splitter_class.assert_called_once_with(
-			chunk_size=1000,
-			chunk_overlap=150
-		)
-		mock_splitter.split_documents.assert_called_once_with(documents)
+		self.assertEqual([len(chunk.page_content) for chunk in result], [1000, 1000, 802])
+		self.assertEqual(result[2].page_content, "A" * 300 + "\n\n" + "B" * 500)
+
+	def test_split_documents_page_metadata(self):
+		"""Testa que cada chunk herda os metadados da página em que começa."""
+		doc1 = Document(page_content="A" * 900, metadata={"page": 0})
+		doc2 = Document(page_content="B" * 500, metadata={"page": 1})
+
+		result = split_documents([doc1, doc2])
+
+		self.assertEqual([chunk.page_content for chunk in result], ["A" * 900, "B" * 500])
+		self.assertEqual([chunk.metadata["page"] for chunk in result], [0, 1])
+
+	def test_split_documents_metadata_copy(self):
+		"""Testa que cada chunk recebe sua própria cópia dos metadados."""
+		documents = [Document(page_content="palavra " * 300, metadata={"page": 0})]
+
+		result = split_documents(documents)
+
+		result[0].metadata["extra"] = True
+		self.assertNotIn("extra", result[1].metadata)
+		self.assertEqual(documents[0].metadata, {"page": 0})
+
+
+class TestFastSplit(unittest.TestCase):
+	"""Testes para o splitter de texto."""
+
+	def test_fast_split_prefers_paragraphs(self):
+		"""Testa corte no separador de maior prioridade antes do limite."""
+		content = "a" * 600 + "\n\n" + "b " * 300 + "c" * 400
+
+		spans = fast_split(content, size=1000, overlap=150)
+
+		self.assertEqual(spans[0], (0, 602))
+
+	def test_fast_split_spans(self):
+		"""Testa tamanho máximo, cobertura do texto e overlap entre chunks."""
+		content = " ".join(f"palavra{i}" for i in range(2000))
+
+		spans = fast_split(content, size=1000, overlap=150)
+
+		self.assertEqual(spans[0][0], 0)
+		self.assertEqual(spans[-1][1], len(content))
+		for (start, end), (next_start, _) in zip(spans, spans[1:]):
+			self.assertLessEqual(end - start, 1000)
+			self.assertLess(next_start, end)
+			self.assertGreaterEqual(next_start, end - 150)
+			self.assertEqual(content[next_start - 1], " ")
+
+	def test_fast_split_short_text(self):
+		"""Testa texto menor que o tamanho do chunk."""
+		self.assertEqual(fast_split("texto curto"), [(0, 11)])
+		self.assertEqual(fast_split(""), [])
 
 
 class TestGetEmbeddings(unittest.TestCase):
 	"""Testes para configuração de embeddings."""
 
-	@patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'})
+	@patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}, clear=True)
 	@patch('langchain_openai.OpenAIEmbeddings')
 	def test_get_embeddings_openai(self, mock_embeddings_class):
 		"""Testa obtenção de embeddings OpenAI."""
@@ -99,7 +164,18 @@ class TestGetEmbeddings(unittest.TestCase):
 
 		# Verificar
 		self.assertEqual(result, mock_embeddings)
-		mock_embeddings_class.assert_called_once()
+		mock_embeddings_class.assert_called_once_with(model="text-embedding-3-small", dimensions=512)
+
+	@patch.dict(os.environ, {
+			'OPENAI_API_KEY': 'test-key',
+			'OPENAI_EMBEDDING_MODEL': 'text-embedding-ada-002'
+	}, clear=True)
+	@patch('langchain_openai.OpenAIEmbeddings')
+	def test_get_embeddings_openai_without_matryoshka(self, mock_embeddings_class):
+		"""Testa que modelos sem Matryoshka mantêm o vetor inteiro."""
+		get_embeddings()
+
+		mock_embeddings_class.assert_called_once_with(model="text-embedding-ada-002", dimensions=None)
 
 	@patch.dict(os.environ, {'GOOGLE_API_KEY': 'test-key'}, clear=True)
 	@patch('langchain_google_genai.GoogleGenerativeAIEmbeddings')
@@ -115,6 +191,30 @@ class TestGetEmbeddings(unittest.TestCase):
 		self.assertEqual(result, mock_embeddings)
 		mock_embeddings_class.assert_called_once_with(model="models/embedding-001")
 
+	@patch.dict(os.environ, {'EMBEDDING_BACKEND': 'local'}, clear=True)
+	@patch('langchain_community.embeddings.FastEmbedEmbeddings')
+	def test_get_embeddings_local(self, mock_embeddings_class):
+		"""Testa obtenção de embeddings locais (FastEmbed) via EMBEDDING_BACKEND."""
+		mock_embeddings = Mock()
+		mock_embeddings_class.return_value = mock_embeddings
+
+		# Executar
+		result = get_embeddings()
+
+		# Verificar
+		self.assertEqual(result, mock_embeddings)
+		mock_embeddings_class.assert_called_once_with(
+			model_name="BAAI/bge-small-en-v1.5",
+			threads=os.cpu_count()
+		)
+
+	@patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key', 'EMBEDDING_BACKEND': ''}, clear=True)
+	@patch('langchain_openai.OpenAIEmbeddings')
+	def test_get_embeddings_empty_backend(self, mock_embeddings_class):
+		"""Testa que EMBEDDING_BACKEND vazia usa o provedor informado."""
+		self.assertEqual(get_embeddings("openai"), mock_embeddings_class.return_value)
+		self.assertEqual(get_max_workers("openai"), 8)
+
 	@patch.dict(os.environ, {}, clear=True)
 	def test_get_embeddings_no_key(self):
 		"""Testa erro quando não há API key."""
@@ -127,16 +227,22 @@ class TestGetEmbeddings(unittest.TestCase):
 class TestStoreDocuments(unittest.TestCase):
 	"""Testes para armazenamento de documentos."""
 
+	@patch('ingest.prepare_ingestion')
+	@patch('ingest.create_hnsw_index')
 	@patch('ingest.PGVector')
-	def test_store_documents(self, mock_pgvector_class):
+	def test_store_documents(self, mock_pgvector_class, mock_create_index, mock_prepare):
 		"""Testa armazenamento de documentos."""
 		# Mock do vectorstore
 		mock_vectorstore = Mock()
 		mock_vectorstore.add_documents = Mock()
+		mock_vectorstore.embeddings.embed_query.return_value = [0.6, 0.8, 0.0]
 		mock_pgvector_class.return_value = mock_vectorstore
 
 		# Mock dos chunks e embeddings
-		mock_chunks = [Mock(), Mock(), Mock()]
+		mock_chunks = [
+			Document(page_content=f"chunk {i}", metadata={"source": "document.pdf", "page": i})
+			for i in range(3)
+		]
 		mock_embeddings = Mock()
 		connection_string = "postgresql://test"
 
@@ -145,12 +251,254 @@ class TestStoreDocuments(unittest.TestCase):
 
 		# Verificar
 		self.assertEqual(result, mock_vectorstore)
-		mock_pgvector_class.assert_called_once_with(
-			embeddings=mock_embeddings,
-			connection=connection_string,
-			use_jsonb=True
-		)
+		mock_pgvector_class.assert_called_once()
+		call_kwargs = mock_pgvector_class.call_args.kwargs
+		self.assertIsInstance(call_kwargs['embeddings'], NormalizedEmbeddings)
+		self.assertIs(call_kwargs['embeddings'].inner, mock_embeddings)
+		self.assertEqual(call_kwargs['connection'], connection_string)
+		self.assertEqual(call_kwargs['use_jsonb'], True)
+		self.assertNotIn('pre_delete_collection', call_kwargs)
+		self.assertEqual(call_kwargs['engine_args'], {"pool_size": 8})
 		mock_vectorstore.add_documents.assert_called_once_with(mock_chunks)
+		mock_create_index.assert_called_once_with(mock_vectorstore)
+		mock_prepare.assert_called_once_with(mock_vectorstore, 3, {"document.pdf"})
+
+	@patch('ingest.prepare_ingestion')
+	@patch('ingest.create_hnsw_index')
+	@patch('ingest.PGVector')
+	def test_store_documents_migrates_before_insert(self, mock_pgvector_class, mock_create_index, mock_prepare):
+		"""Testa que a tabela é preparada antes da inserção e o índice criado depois."""
+		calls = Mock()
+		mock_vectorstore = Mock()
+		mock_vectorstore.embeddings.embed_query.return_value = [0.1] * 512
+		mock_vectorstore.add_documents = calls.add_documents
+		mock_pgvector_class.return_value = mock_vectorstore
+		mock_prepare.side_effect = calls.prepare_ingestion
+		mock_create_index.side_effect = calls.create_hnsw_index
+
+		store_documents([Document(page_content="chunk", metadata={})], Mock(), "postgresql://test")
+
+		self.assertEqual(
+			[c[0] for c in calls.mock_calls],
+			["prepare_ingestion", "add_documents", "create_hnsw_index"]
+		)
+		mock_prepare.assert_called_once_with(mock_vectorstore, 512, set())
+
+	@patch('ingest.prepare_ingestion')
+	@patch('ingest.create_hnsw_index')
+	@patch('ingest.PGVector')
+	def test_store_documents_embedding_error_changes_nothing(self, mock_pgvector_class, mock_create_index,
+			mock_prepare):
+		"""Testa que uma falha nos embeddings (ex.: API key inválida) não altera o banco."""
+		mock_vectorstore = Mock()
+		mock_vectorstore.embeddings.embed_query.side_effect = RuntimeError("invalid api key")
+		mock_pgvector_class.return_value = mock_vectorstore
+
+		with self.assertRaises(RuntimeError):
+			store_documents([Document(page_content="chunk", metadata={"source": "a.pdf"})], Mock(), "postgresql://test")
+
+		mock_prepare.assert_not_called()
+		mock_vectorstore.add_documents.assert_not_called()
+		mock_create_index.assert_not_called()
+
+	@patch('ingest.prepare_ingestion')
+	@patch('ingest.create_hnsw_index')
+	@patch('ingest.PGVector')
+	def test_store_documents_batches(self, mock_pgvector_class, mock_create_index, mock_prepare):
+		"""Testa envio dos chunks em lotes."""
+		mock_vectorstore = Mock()
+		mock_vectorstore.embeddings.embed_query.return_value = [1.0, 0.0]
+		mock_pgvector_class.return_value = mock_vectorstore
+		mock_chunks = [Document(page_content=f"chunk {i}", metadata={}) for i in range(5)]
+
+		store_documents(mock_chunks, Mock(), "postgresql://test", batch_size=2, max_workers=1)
+
+		batches = sorted(
+			(c.args[0] for c in mock_vectorstore.add_documents.call_args_list),
+			key=lambda batch: mock_chunks.index(batch[0])
+		)
+		self.assertEqual(batches, [mock_chunks[0:2], mock_chunks[2:4], mock_chunks[4:5]])
+		self.assertEqual(mock_pgvector_class.call_args.kwargs['engine_args'], {"pool_size": 1})
+
+	@patch.dict(os.environ, {}, clear=True)
+	def test_get_batch_size_defaults(self):
+		"""Testa tamanho de lote padrão de cada provedor."""
+		self.assertEqual(get_batch_size("openai"), 256)
+		self.assertEqual(get_batch_size("google"), 100)
+
+	@patch.dict(os.environ, {}, clear=True)
+	def test_get_max_workers(self):
+		"""Testa um único lote por vez para o modelo local, que já usa todos os núcleos."""
+		self.assertEqual(get_max_workers("openai"), 8)
+		self.assertEqual(get_max_workers("local"), 1)
+
+		with patch.dict(os.environ, {'EMBEDDING_BACKEND': 'local'}):
+			self.assertEqual(get_max_workers("openai"), 1)
+
+	@patch.dict(os.environ, {'EMBED_BATCH_SIZE': '500'})
+	def test_get_batch_size_respects_provider_limit(self):
+		"""Testa que EMBED_BATCH_SIZE não ultrapassa o limite do provedor."""
+		self.assertEqual(get_batch_size("google"), 100)
+
+
+class TestHnswIndex(unittest.TestCase):
+	"""Testes para tipagem da coluna e criação do índice HNSW."""
+
+	def setUp(self):
+		self.vectorstore = MagicMock()
+		self.vectorstore.EmbeddingStore.__tablename__ = "langchain_pg_embedding"
+		self.vectorstore.CollectionStore.__tablename__ = "langchain_pg_collection"
+		self.vectorstore.collection_name = "documents"
+		self.session = self.vectorstore.session_maker.return_value.__enter__.return_value
+
+	def statements(self):
+		return [str(c.args[0]) for c in self.session.execute.call_args_list]
+
+	def test_configure_hnsw_params(self):
+		"""Testa escolha dos parâmetros por volume de vetores."""
+		self.assertEqual(configure_hnsw_params(1_000), (16, 64))
+		self.assertEqual(configure_hnsw_params(500_000), (24, 100))
+		self.assertEqual(configure_hnsw_params(5_000_000), (32, 128))
+
+	def test_prepare_ingestion(self):
+		"""Testa remoção dos chunks substituídos e do cache e conversão da coluna para halfvec."""
+		self.session.execute.return_value.scalar.side_effect = ["vector", 0]
+
+		prepare_ingestion(self.vectorstore, 1536, {"b.pdf", "a.pdf"}, dtype="halfvec")
+
+		mismatch_call = self.session.execute.call_args_list[1]
+		self.assertEqual(mismatch_call.args[1], {
+			"dimensions": 1536,
+			"cache": "semantic_cache",
+			"name": "documents",
+			"sources": ["a.pdf", "b.pdf"]
+		})
+		self.assertEqual(self.statements()[2:], [
+			"DELETE FROM langchain_pg_embedding WHERE collection_id = "
+			"(SELECT uuid FROM langchain_pg_collection WHERE name = :name) "
+			"AND cmetadata->>'source' = ANY(:sources)",
+			"DELETE FROM langchain_pg_embedding WHERE collection_id = "
+			"(SELECT uuid FROM langchain_pg_collection WHERE name = :name)",
+			"DROP INDEX IF EXISTS idx_langchain_pg_embedding_hnsw",
+			"ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE halfvec(1536) "
+			"USING embedding::halfvec(1536)"
+		])
+		self.assertEqual(self.session.execute.call_args_list[2].args[1], {
+			"name": "documents",
+			"sources": ["a.pdf", "b.pdf"]
+		})
+		self.assertEqual(self.session.execute.call_args_list[3].args[1], {"name": "semantic_cache"})
+		self.session.commit.assert_called_once()
+
+	def test_prepare_ingestion_already_typed(self):
+		"""Testa que a coluna já no tipo e dimensão configurados não é convertida."""
+		self.session.execute.return_value.scalar.side_effect = ["vector(1536)"]
+
+		prepare_ingestion(self.vectorstore, 1536, {"a.pdf"}, dtype="vector")
+
+		statements = self.statements()
+		self.assertEqual(len(statements), 3)
+		self.assertTrue(all(s.startswith("DELETE FROM") for s in statements[1:]))
+		self.session.commit.assert_called_once()
+
+	def test_prepare_ingestion_without_sources(self):
+		"""Testa que sem arquivos de origem apenas o cache é removido."""
+		self.session.execute.return_value.scalar.side_effect = ["halfvec(512)"]
+
+		prepare_ingestion(self.vectorstore, 512, set(), dtype="halfvec")
+
+		self.assertEqual(self.statements()[1:], [
+			"DELETE FROM langchain_pg_embedding WHERE collection_id = "
+			"(SELECT uuid FROM langchain_pg_collection WHERE name = :name)"
+		])
+
+	def test_prepare_ingestion_other_dimensions(self):
+		"""Testa que, com vetores mantidos de outra dimensão, nada é removido nem convertido."""
+		self.session.execute.return_value.scalar.side_effect = ["halfvec(1536)", 120]
+
+		with self.assertRaises(ValueError) as context:
+			prepare_ingestion(self.vectorstore, 384, {"a.pdf"}, dtype="halfvec")
+
+		self.assertIn("120 vetores com dimensão diferente de 384", str(context.exception))
+		self.assertFalse(any(
+			s.startswith(("DELETE FROM", "ALTER TABLE", "DROP INDEX")) for s in self.statements()
+		))
+		self.session.commit.assert_not_called()
+
+	def test_create_hnsw_index(self):
+		"""Testa criação do índice por produto interno com os parâmetros da faixa."""
+		self.session.execute.return_value.scalar.side_effect = [1000, None]
+
+		create_hnsw_index(self.vectorstore, dtype="halfvec")
+
+		statements = self.statements()
+		self.assertIn("SET LOCAL maintenance_work_mem = '1GB'", statements)
+		self.assertIn("SET LOCAL max_parallel_maintenance_workers = 7", statements)
+		self.assertFalse(any(s.startswith(("ALTER TABLE", "DROP INDEX")) for s in statements))
+		self.assertIn(
+			"CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_hnsw ON langchain_pg_embedding "
+			"USING hnsw (embedding halfvec_ip_ops) WITH (m = 16, ef_construction = 64)",
+			statements
+		)
+		self.session.commit.assert_called_once()
+
+	def test_create_hnsw_index_existing(self):
+		"""Testa que um índice existente com o mesmo opclass é mantido."""
+		self.session.execute.return_value.scalar.side_effect = [
+			1000,
+			"CREATE INDEX idx_langchain_pg_embedding_hnsw ON public.langchain_pg_embedding "
+			"USING hnsw (embedding vector_ip_ops) WITH (m='16', ef_construction='64')"
+		]
+
+		create_hnsw_index(self.vectorstore, dtype="vector")
+
+		statements = self.statements()
+		self.assertFalse(any(s.startswith("DROP INDEX") for s in statements))
+		self.assertIn(
+			"CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_hnsw ON langchain_pg_embedding "
+			"USING hnsw (embedding vector_ip_ops) WITH (m = 16, ef_construction = 64)",
+			statements
+		)
+
+	def test_create_hnsw_index_rebuilds_cosine_index(self):
+		"""Testa que um índice com outro opclass (cosseno) é recriado com produto interno."""
+		self.session.execute.return_value.scalar.side_effect = [
+			1000,
+			"CREATE INDEX idx_langchain_pg_embedding_hnsw ON public.langchain_pg_embedding "
+			"USING hnsw (embedding halfvec_cosine_ops) WITH (m='16', ef_construction='64')"
+		]
+
+		create_hnsw_index(self.vectorstore, dtype="halfvec")
+
+		self.assertIn("DROP INDEX IF EXISTS idx_langchain_pg_embedding_hnsw", self.statements())
+
+	def test_create_hnsw_index_rebuilds_halfvec_index_for_vector(self):
+		"""Testa que um índice halfvec_ip_ops não é confundido com vector_ip_ops."""
+		self.session.execute.return_value.scalar.side_effect = [
+			1000,
+			"CREATE INDEX idx_langchain_pg_embedding_hnsw ON public.langchain_pg_embedding "
+			"USING hnsw (embedding halfvec_ip_ops) WITH (m='16', ef_construction='64')"
+		]
+
+		create_hnsw_index(self.vectorstore, dtype="vector")
+
+		self.assertIn("DROP INDEX IF EXISTS idx_langchain_pg_embedding_hnsw", self.statements())
+
+	def test_create_hnsw_index_invalid_dtype(self):
+		"""Testa erro para tipo de coluna não suportado."""
+		with self.assertRaises(ValueError):
+			create_hnsw_index(MagicMock(), dtype="bit")
+		with self.assertRaises(ValueError):
+			prepare_ingestion(MagicMock(), 1536, dtype="bit")
+
+	def test_create_hnsw_index_empty_table(self):
+		"""Testa que nenhum índice é criado sem vetores armazenados."""
+		self.session.execute.return_value.scalar.side_effect = [0]
+
+		create_hnsw_index(self.vectorstore)
+
+		self.assertEqual(self.session.execute.call_count, 1)
+		self.session.commit.assert_not_called()
 
 
 class TestIngestPdf(unittest.TestCase):
@@ -3,12 +3,29 @@ from unittest.mock import Mock, patch, MagicMock
 import os
 import sys
 
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListLLM
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableSequence
+from langchain_postgres.vectorstores import DistanceStrategy, _get_embedding_collection_store
+from sqlalchemy.dialects import postgresql
+
 # Adicionar src ao path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
+from semantic_cache import SemanticCache
+from embeddings import NormalizedEmbeddings, WarmedUpEmbeddings
 from search import (
 	get_embeddings,
+	get_engine,
 	get_vectorstore,
+	get_semantic_cache,
+	search_documents,
+	retrieve_documents,
+	build_context,
+	rerank,
 	search_prompt,
 	create_rag_chain,
 	PROMPT_TEMPLATE
@@ -18,7 +35,10 @@ from search import (
 class TestGetEmbeddings(unittest.TestCase):
 	"""Testes para obtenção de embeddings."""
 
-	@patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'})
+	def setUp(self):
+		get_embeddings.cache_clear()
+
+	@patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}, clear=True)
 	@patch('langchain_openai.OpenAIEmbeddings')
 	def test_get_embeddings_openai(self, mock_embeddings_class):
 		"""Testa obtenção de embeddings OpenAI."""
@@ -28,7 +48,26 @@ class TestGetEmbeddings(unittest.TestCase):
 		result = get_embeddings()
 
 		self.assertEqual(result, mock_embeddings)
-		mock_embeddings_class.assert_called_once()
+		mock_embeddings_class.assert_called_once_with(model="text-embedding-3-small", dimensions=512)
+
+	@patch.dict(os.environ, {'EMBEDDING_BACKEND': 'local'}, clear=True)
+	@patch('langchain_community.embeddings.FastEmbedEmbeddings')
+	def test_get_embeddings_local(self, mock_embeddings_class):
+		"""Testa obtenção de embeddings locais (FastEmbed) via EMBEDDING_BACKEND."""
+		mock_embeddings = Mock()
+		mock_embeddings.embed_query.return_value = [0.1, 0.2]
+		mock_embeddings_class.return_value = mock_embeddings
+
+		result = get_embeddings()
+
+		self.assertIsInstance(result, WarmedUpEmbeddings)
+		self.assertTrue(result.wait(timeout=5))
+		self.assertIs(result.inner, mock_embeddings)
+		mock_embeddings_class.assert_called_once_with(
+			model_name="BAAI/bge-small-en-v1.5",
+			threads=os.cpu_count()
+		)
+		mock_embeddings.embed_query.assert_called_once_with("warmup")
 
 	@patch.dict(os.environ, {}, clear=True)
 	def test_get_embeddings_no_key(self):
@@ -37,30 +76,72 @@ class TestGetEmbeddings(unittest.TestCase):
 			get_embeddings()
 
 
+class TestGetEngine(unittest.TestCase):
+	"""Testes para o pool de conexões compartilhado."""
+
+	def setUp(self):
+		get_engine.cache_clear()
+
+	def tearDown(self):
+		get_engine.cache_clear()
+
+	@patch('search.create_engine')
+	@patch.dict(os.environ, {'POSTGRES_CONNECTION_STRING': 'postgresql://test'}, clear=True)
+	def test_get_engine(self, mock_create_engine):
+		"""Testa criação única do engine com pool e hnsw.ef_search."""
+		mock_engine = Mock()
+		mock_create_engine.return_value = mock_engine
+
+		result = get_engine()
+
+		self.assertEqual(result, mock_engine)
+		self.assertIs(get_engine(), result)
+		mock_create_engine.assert_called_once_with(
+			'postgresql://test',
+			pool_size=8,
+			connect_args={"options": "-c hnsw.ef_search=100"}
+		)
+
+	@patch.dict(os.environ, {}, clear=True)
+	def test_get_engine_no_connection_string(self):
+		"""Testa erro quando não há string de conexão."""
+		with self.assertRaises(ValueError):
+			get_engine()
+
+
 class TestGetVectorstore(unittest.TestCase):
 	"""Testes para obtenção do vectorstore."""
 
+	def setUp(self):
+		get_vectorstore.cache_clear()
+		get_engine.cache_clear()
+
+	@patch('search.get_engine')
 	@patch('search.get_embeddings')
-	@patch('search.PGVector')
-	@patch.dict(os.environ, {
-		'POSTGRES_CONNECTION_STRING': 'postgresql://test',
-		'OPENAI_API_KEY': 'test-key'
-	}, clear=True)
-	def test_get_vectorstore(self, mock_pgvector_class, mock_get_embeddings):
+	@patch('langchain_postgres.PGVector')
+	@patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}, clear=True)
+	def test_get_vectorstore(self, mock_pgvector_class, mock_get_embeddings, mock_get_engine):
 		"""Testa obtenção do vectorstore."""
 		mock_embeddings = Mock()
 		mock_get_embeddings.return_value = mock_embeddings
 
+		mock_engine = Mock()
+		mock_get_engine.return_value = mock_engine
+
 		mock_vectorstore = Mock()
 		mock_pgvector_class.return_value = mock_vectorstore
 
 		result = get_vectorstore()
 
 		self.assertEqual(result, mock_vectorstore)
+		self.assertIs(get_vectorstore(), result)
 		mock_get_embeddings.assert_called_once()
+		mock_pgvector_class.assert_called_once()
 		call_args = mock_pgvector_class.call_args
-		self.assertEqual(call_args.kwargs['embeddings'], mock_embeddings)
-		self.assertEqual(call_args.kwargs['connection'], 'postgresql://test')
+		self.assertIsInstance(call_args.kwargs['embeddings'], NormalizedEmbeddings)
+		self.assertIs(call_args.kwargs['embeddings'].inner, mock_embeddings)
+		self.assertEqual(call_args.kwargs['distance_strategy'], DistanceStrategy.MAX_INNER_PRODUCT)
+		self.assertEqual(call_args.kwargs['connection'], mock_engine)
 		self.assertEqual(call_args.kwargs['use_jsonb'], True)
 
 	@patch.dict(os.environ, {}, clear=True)
@@ -70,11 +151,153 @@ class TestGetVectorstore(unittest.TestCase):
 			get_vectorstore()
 
 
+class TestGetSemanticCache(unittest.TestCase):
+	"""Testes para obtenção do cache semântico."""
+
+	def setUp(self):
+		get_semantic_cache.cache_clear()
+		get_engine.cache_clear()
+
+	@patch('search.get_engine')
+	@patch('search.get_embeddings')
+	@patch('langchain_postgres.PGVector')
+	def test_get_semantic_cache(self, mock_pgvector_class, mock_get_embeddings, mock_get_engine):
+		"""Testa criação do cache persistido na coleção semantic_cache, no pool compartilhado."""
+		mock_store = Mock()
+		mock_pgvector_class.return_value = mock_store
+
+		result = get_semantic_cache()
+
+		self.assertIs(result.store, mock_store)
+		self.assertIs(get_semantic_cache(), result)
+		self.assertEqual(mock_pgvector_class.call_args.kwargs['collection_name'], 'semantic_cache')
+		self.assertEqual(mock_pgvector_class.call_args.kwargs['connection'], mock_get_engine.return_value)
+		mock_get_embeddings.assert_called_once()
+
+	@patch.dict(os.environ, {}, clear=True)
+	def test_get_semantic_cache_no_connection_string(self):
+		"""Testa erro quando não há string de conexão."""
+		with self.assertRaises(ValueError):
+			get_semantic_cache()
+
+
+class TestSearchDocuments(unittest.TestCase):
+	"""Testes para a busca vetorial sem a coluna de embeddings."""
+
+	def setUp(self):
+		EmbeddingStore, CollectionStore = _get_embedding_collection_store()
+		self.vectorstore = MagicMock()
+		self.vectorstore.EmbeddingStore = EmbeddingStore
+		self.vectorstore.CollectionStore = CollectionStore
+		self.vectorstore.collection_name = "langchain"
+		self.vectorstore.distance_strategy = EmbeddingStore.embedding.cosine_distance
+		self.session = self.vectorstore.session_maker.return_value.__enter__.return_value
+
+	def test_search_documents(self):
+		"""Testa que apenas document, cmetadata e distância são selecionados."""
+		row = Mock(document="Contexto 1", cmetadata={"page": 1}, distance=0.1)
+		self.session.execute.return_value.all.return_value = [row]
+
+		result = search_documents(self.vectorstore, [0.1, 0.2], k=10)
+
+		self.assertEqual(len(result), 1)
+		doc, distance = result[0]
+		self.assertEqual(doc.page_content, "Contexto 1")
+		self.assertEqual(doc.metadata, {"page": 1})
+		self.assertEqual(distance, 0.1)
+
+		statement = self.session.execute.call_args.args[0]
+		self.assertEqual(
+			[column.name for column in statement.selected_columns],
+			["document", "cmetadata", "distance"]
+		)
+		sql = str(statement.compile(dialect=postgresql.dialect()))
+		self.assertIn("langchain_pg_embedding.embedding <=>", sql)
+		self.assertIn("langchain_pg_collection.name", sql)
+		self.assertIn("LIMIT", sql)
+
+
+class TestRetrieveDocuments(unittest.TestCase):
+	"""Testes para a seleção dos chunks de contexto."""
+
+	@patch('search.search_documents')
+	def test_retrieve_documents(self, mock_search_documents):
+		"""Testa que, sem MMR, os documentos vêm da busca por similaridade."""
+		doc1, doc2 = Mock(), Mock()
+		mock_search_documents.return_value = [(doc1, 0.1), (doc2, 0.2)]
+		vectorstore = Mock()
+
+		result = retrieve_documents(vectorstore, [0.1, 0.2], k=2)
+
+		self.assertEqual(result, [doc1, doc2])
+		mock_search_documents.assert_called_once_with(vectorstore, [0.1, 0.2], k=2)
+		vectorstore.max_marginal_relevance_search_by_vector.assert_not_called()
+
+	@patch('search.RAG_MMR', True)
+	@patch('search.search_documents')
+	def test_retrieve_documents_mmr(self, mock_search_documents):
+		"""Testa seleção por MMR entre RAG_FETCH_K candidatos."""
+		vectorstore = Mock()
+		vectorstore.max_marginal_relevance_search_by_vector.return_value = ["doc"]
+
+		result = retrieve_documents(vectorstore, np.array([0.6, 0.8], dtype=np.float32), k=5)
+
+		self.assertEqual(result, ["doc"])
+		vectorstore.max_marginal_relevance_search_by_vector.assert_called_once()
+		call = vectorstore.max_marginal_relevance_search_by_vector.call_args
+		self.assertEqual(call.kwargs, {"k": 5, "fetch_k": 20})
+		self.assertIsInstance(call.args[0][0], float)
+		mock_search_documents.assert_not_called()
+
+
+class TestBuildContext(unittest.TestCase):
+	"""Testes para a montagem do contexto."""
+
+	def test_build_context(self):
+		"""Testa concatenação dos chunks separados por linha em branco."""
+		docs = [Document(page_content="Contexto 1"), Document(page_content="Contexto 2")]
+
+		self.assertEqual(build_context(docs), "Contexto 1\n\nContexto 2")
+		self.assertEqual(build_context([]), "")
+
+
+class TestRerank(unittest.TestCase):
+	"""Testes para o re-ranking por similaridade cosseno."""
+
+	def test_rerank(self):
+		"""Testa ordenação dos candidatos mais similares."""
+		query = [1.0, 0.0]
+		docs = [[0.0, 1.0], [10.0, 1.0], [1.0, 1.0], [-1.0, 0.0]]
+
+		result = rerank(query, docs, topk=2)
+
+		self.assertEqual(result.tolist(), [1, 2])
+
+	def test_rerank_topk_larger_than_candidates(self):
+		"""Testa topk maior que a quantidade de candidatos."""
+		result = rerank([1.0, 0.0], [[0.0, 1.0], [1.0, 0.0], [0.0, 0.0]], topk=10)
+
+		self.assertEqual(result.tolist(), [1, 0, 2])
+
+	def test_rerank_empty(self):
+		"""Testa lista de candidatos vazia."""
+		self.assertEqual(rerank([1.0, 0.0], np.empty((0, 2)), topk=5).tolist(), [])
+
+
 class TestSearchPrompt(unittest.TestCase):
 	"""Testes para busca e montagem de prompt."""
 
+	def setUp(self):
+		# Cache semântico sempre em miss, salvo quando o teste indicar o contrário
+		self.mock_cache = Mock()
+		self.mock_cache.lookup.return_value = (None, [0.1, 0.2])
+		patcher = patch('search.get_semantic_cache', return_value=self.mock_cache)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	@patch('search.search_documents')
 	@patch('search.get_vectorstore')
-	def test_search_prompt_success(self, mock_get_vectorstore):
+	def test_search_prompt_success(self, mock_get_vectorstore, mock_search_documents):
 		"""Testa busca bem-sucedida e montagem de prompt."""
 		# Mock do vectorstore
 		mock_vectorstore = Mock()
@@ -82,7 +305,7 @@ class TestSearchPrompt(unittest.TestCase):
 		mock_doc1.page_content = "Contexto 1"
 		mock_doc2 = Mock()
 		mock_doc2.page_content = "Contexto 2"
-		mock_vectorstore.similarity_search_with_score.return_value = [
+		mock_search_documents.return_value = [
 			(mock_doc1, 0.1),
 			(mock_doc2, 0.2)
 		]
@@ -98,11 +321,93 @@ class TestSearchPrompt(unittest.TestCase):
 		self.assertIn("Contexto 2", result)
 		self.assertIn("Qual o faturamento?", result)
 		self.assertIn("PERGUNTA DO USUÁRIO:", result)
-		mock_vectorstore.similarity_search_with_score.assert_called_once_with(
-			query="Qual o faturamento?",
-			k=10
+		self.assertEqual(
+			result,
+			PROMPT_TEMPLATE.format(context="Contexto 1\n\nContexto 2", query="Qual o faturamento?")
+		)
+		mock_search_documents.assert_called_once_with(mock_vectorstore, [0.1, 0.2], k=5)
+		self.mock_cache.put.assert_called_once_with(
+			"Qual o faturamento?",
+			[0.1, 0.2],
+			{"context": "Contexto 1\n\nContexto 2"}
 		)
 
+	@patch('search.RAG_TOP_K', 3)
+	@patch('search.search_documents')
+	@patch('search.get_vectorstore')
+	def test_search_prompt_top_k(self, mock_get_vectorstore, mock_search_documents):
+		"""Testa que a quantidade de chunks segue RAG_TOP_K."""
+		mock_search_documents.return_value = []
+
+		search_prompt("Qual o faturamento?")
+
+		mock_search_documents.assert_called_once_with(mock_get_vectorstore.return_value, [0.1, 0.2], k=3)
+
+	@patch('search.search_documents')
+	@patch('search.get_vectorstore')
+	def test_search_prompt_cache_store_error(self, mock_get_vectorstore, mock_search_documents):
+		"""Testa que a coleção do cache indisponível não interrompe a busca."""
+		embeddings = Mock()
+		embeddings.embed_query.return_value = [1.0, 0.0]
+		store = Mock()
+		store.similarity_search_with_score_by_vector.side_effect = ValueError("Collection not found")
+		store.add_embeddings.side_effect = ValueError("Collection not found")
+		cache = SemanticCache(embeddings, max_entries=4, store=store)
+		mock_doc = Mock()
+		mock_doc.page_content = "Contexto 1"
+		mock_search_documents.return_value = [(mock_doc, 0.1)]
+
+		with patch('search.get_semantic_cache', return_value=cache), patch('builtins.print'), \
+				self.assertLogs("semantic_cache", level="WARNING"):
+			result = search_prompt("Qual o faturamento?")
+
+		self.assertIn("Contexto 1", result)
+
+	@patch('search.search_documents')
+	@patch('search.get_vectorstore')
+	def test_search_prompt_cache_put_error(self, mock_get_vectorstore, mock_search_documents):
+		"""Testa que uma falha ao gravar no cache não descarta a busca."""
+		mock_doc = Mock()
+		mock_doc.page_content = "Contexto 1"
+		mock_search_documents.return_value = [(mock_doc, 0.1)]
+		self.mock_cache.put.side_effect = Exception("Erro de conexão")
+
+		with patch('builtins.print'):
+			result = search_prompt("Qual o faturamento?")
+
+		self.assertIsNotNone(result)
+		self.assertIn("Contexto 1", result)
+
+	@patch('search.get_vectorstore')
+	def test_search_prompt_cache_hit(self, mock_get_vectorstore):
+		"""Testa que um hit no cache evita a busca no vectorstore."""
+		self.mock_cache.lookup.return_value = ({"context": "Contexto em cache"}, None)
+
+		result = search_prompt("Qual o faturamento?")
+
+		self.assertIn("Contexto em cache", result)
+		mock_get_vectorstore.assert_not_called()
+		self.mock_cache.put.assert_not_called()
+
+	@patch('search.search_documents')
+	@patch('search.get_vectorstore')
+	def test_search_prompt_embeds_once(self, mock_get_vectorstore, mock_search_documents):
+		"""Testa que a pergunta é vetorizada uma única vez para cache e busca."""
+		embeddings = Mock()
+		embeddings.embed_query.return_value = [3.0, 4.0]
+		cache = SemanticCache(embeddings, max_entries=4)
+		mock_search_documents.return_value = []
+
+		with patch('search.get_semantic_cache', return_value=cache):
+			search_prompt("Qual o faturamento?")
+			search_prompt("Qual o faturamento?")
+
+		embeddings.embed_query.assert_called_once_with("Qual o faturamento?")
+		mock_search_documents.assert_called_once()
+		q_emb = mock_search_documents.call_args.args[1]
+		self.assertAlmostEqual(float(q_emb[0]), 0.6, places=5)
+		self.assertAlmostEqual(float(q_emb[1]), 0.8, places=5)
+
 	def test_search_prompt_empty_question(self):
 		"""Testa retorno None para pergunta vazia."""
 		result = search_prompt("")
@@ -123,30 +428,28 @@ class TestSearchPrompt(unittest.TestCase):
 class TestCreateRagChain(unittest.TestCase):
 	"""Testes para criação da chain RAG."""
 
-	@patch('search.PromptTemplate')
-	@patch('search.LLMChain')
-	def test_create_rag_chain(self, mock_chain_class, mock_prompt_class):
-		"""Testa criação da chain RAG."""
-		mock_llm = Mock()
-		mock_prompt_template = Mock()
-		mock_prompt_class.return_value = mock_prompt_template
-
-		mock_chain = Mock()
-		mock_chain_class.return_value = mock_chain
+	def test_create_rag_chain(self):
+		"""Testa composição prompt | llm | StrOutputParser da chain RAG."""
+		llm = FakeListLLM(responses=["Resposta"])
 
 		# Executar
-		result = create_rag_chain(mock_llm)
+		result = create_rag_chain(llm)
 
 		# Verificar
-		self.assertEqual(result, mock_chain)
-		mock_prompt_class.assert_called_once_with(
-			template=PROMPT_TEMPLATE,
-			input_variables=["context", "query"]
-		)
-		mock_chain_class.assert_called_once_with(
-			llm=mock_llm,
-			prompt=mock_prompt_template
-		)
+		self.assertIsInstance(result, RunnableSequence)
+		self.assertIsInstance(result.first, PromptTemplate)
+		self.assertEqual(result.first.template, PROMPT_TEMPLATE)
+		self.assertEqual(result.middle, [llm])
+		self.assertIsInstance(result.last, StrOutputParser)
+		self.assertEqual(result.invoke({"context": "Contexto", "query": "Pergunta"}), "Resposta")
+
+	def test_create_rag_chain_stream(self):
+		"""Testa streaming da resposta pela chain RAG."""
+		chain = create_rag_chain(FakeListLLM(responses=["Resposta"]))
+
+		tokens = list(chain.stream({"context": "Contexto", "query": "Pergunta"}))
+
+		self.assertEqual("".join(tokens), "Resposta")
 
 
 class TestPromptTemplate(unittest.TestCase):
@@ -0,0 +1,134 @@
+import unittest
+from unittest.mock import Mock, patch
+import os
+import sys
+
+# Adicionar src ao path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from concurrent.futures import ThreadPoolExecutor
+
+from semantic_cache import SemanticCache
+
+
+class TestSemanticCache(unittest.TestCase):
+	"""Testes para o cache semântico."""
+
+	def setUp(self):
+		self.embeddings = Mock()
+		self.cache = SemanticCache(self.embeddings, threshold=0.95, max_entries=2, ttl_days=7)
+
+	def test_miss_returns_embedding(self):
+		"""Testa miss em cache vazio retornando o embedding calculado."""
+		self.embeddings.embed_query.return_value = [3.0, 4.0]
+
+		value, embedding = self.cache.lookup("Pergunta")
+
+		self.assertIsNone(value)
+		self.assertAlmostEqual(float(embedding[0]), 0.6, places=5)
+		self.assertAlmostEqual(float(embedding[1]), 0.8, places=5)
+
+	def test_exact_hit_skips_embedding(self):
+		"""Testa que o nível exato não chama o modelo de embeddings."""
+		self.cache.put("Pergunta", [1.0, 0.0], {"answer": "Resposta"})
+
+		result, embedding = self.cache.lookup("Pergunta")
+
+		self.assertEqual(result, {"answer": "Resposta"})
+		self.assertEqual(embedding.tolist(), [1.0, 0.0])
+		self.embeddings.embed_query.assert_not_called()
+
+	def test_semantic_hit(self):
+		"""Testa hit para pergunta com embedding similar acima do threshold."""
+		self.cache.put("Qual o faturamento?", [1.0, 0.0], "Resposta")
+		self.embeddings.embed_query.return_value = [0.99, 0.05]
+
+		self.assertEqual(self.cache.get("Qual foi o faturamento?"), "Resposta")
+
+	def test_semantic_miss_below_threshold(self):
+		"""Testa miss para pergunta com similaridade abaixo do threshold."""
+		self.cache.put("Qual o faturamento?", [1.0, 0.0], "Resposta")
+		self.embeddings.embed_query.return_value = [0.5, 0.5]
+
+		self.assertIsNone(self.cache.get("Quantos funcionários?"))
+
+	def test_lru_eviction(self):
+		"""Testa que a entrada menos usada recentemente é descartada."""
+		self.cache.put("A", [1.0, 0.0], "a")
+		self.cache.put("B", [0.0, 1.0], "b")
+		self.cache.get("A")
+		self.cache.put("C", [-1.0, 0.0], "c")
+
+		self.embeddings.embed_query.return_value = [0.0, 1.0]
+		self.assertIsNone(self.cache.get("B"))
+		self.assertEqual(self.cache.get("A"), "a")
+		self.assertEqual(self.cache.get("C"), "c")
+
+	@patch('semantic_cache.time.time')
+	def test_ttl_expired(self, mock_time):
+		"""Testa que entradas mais antigas que o TTL são ignoradas."""
+		mock_time.return_value = 0
+		self.cache.put("Pergunta", [1.0, 0.0], "Resposta")
+		mock_time.return_value = 8 * 86400
+		self.embeddings.embed_query.return_value = [1.0, 0.0]
+
+		self.assertIsNone(self.cache.get("Pergunta"))
+
+	def test_store_persistence(self):
+		"""Testa gravação e leitura da coleção persistida."""
+		store = Mock()
+		cache = SemanticCache(self.embeddings, threshold=0.95, max_entries=2, store=store)
+
+		cache.put("Pergunta", [1.0, 0.0], "Resposta")
+		call_kwargs = store.add_embeddings.call_args.kwargs
+		self.assertEqual(call_kwargs['texts'], ["Pergunta"])
+		self.assertEqual(call_kwargs['ids'], [SemanticCache.key("Pergunta")])
+		self.assertEqual(call_kwargs['metadatas'][0]['value'], "Resposta")
+
+		# Novo processo: cache em memória vazio, hit vem do vectorstore
+		restored = SemanticCache(self.embeddings, threshold=0.95, max_entries=2, store=store)
+		doc = Mock()
+		doc.metadata = call_kwargs['metadatas'][0]
+		store.similarity_search_with_score_by_vector.return_value = [(doc, -0.99)]
+		self.embeddings.embed_query.return_value = [1.0, 0.0]
+
+		self.assertEqual(restored.get("Pergunta"), "Resposta")
+		self.assertEqual(restored.get("Pergunta"), "Resposta")
+		store.similarity_search_with_score_by_vector.assert_called_once()
+
+
+	def test_store_error_is_miss(self):
+		"""Testa que uma falha na coleção persistida conta como miss."""
+		store = Mock()
+		store.similarity_search_with_score_by_vector.side_effect = ValueError("Collection not found")
+		cache = SemanticCache(self.embeddings, threshold=0.95, max_entries=2, store=store)
+		self.embeddings.embed_query.return_value = [1.0, 0.0]
+
+		with self.assertLogs("semantic_cache", level="WARNING"):
+			value, embedding = cache.lookup("Pergunta")
+
+		self.assertIsNone(value)
+		self.assertEqual(embedding.tolist(), [1.0, 0.0])
+
+	def test_concurrent_put_and_lookup(self):
+		"""Testa gravações com despejo LRU concorrentes com consultas."""
+		cache = SemanticCache(self.embeddings, threshold=0.5, max_entries=4)
+		vectors = [[1.0, i / 100] for i in range(100)]
+
+		def put(i):
+			cache.put(f"Pergunta {i}", vectors[i], i)
+
+		def lookup(i):
+			return cache.lookup(f"Pergunta {i}", vectors[i])
+
+		with ThreadPoolExecutor(max_workers=8) as executor:
+			puts = [executor.submit(put, i) for i in range(100)]
+			lookups = [executor.submit(lookup, i) for i in range(100)]
+			for future in puts + lookups:
+				future.result()
+
+		self.assertEqual(len(cache.exact), 4)
+		self.assertEqual(sorted(cache.exact.values()), [0, 1, 2, 3])
+
+if __name__ == '__main__':
+	unittest.main()